@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Throughput benchmarks for the log parsers in texparser.py.
+#
+# Every parser is run on generated logs (see genlogs.py) and on the recorded logs in the
+# logs directory next to this script, if there are any.  Recorded logs are named after the
+# kind of output they hold: latex-*.log, bibtex-*.log, latexmk-*.log or chktex-*.log.
+#
+# Each measurement runs in a fresh interpreter, so the peak memory (ru_maxrss) belongs to that
+# parse alone.  The best of --repeat runs is reported as lines/sec, and the results are saved
+# as JSON in <output>/<label>.json; the output directory is benchmarks in the bundle's cache
+# directory (see cachestore.py) unless --output names another.  With --compare the speeds are
+# set against an earlier result file and slowdowns beyond --threshold are flagged.
+#
+# Usage: benchparsers.py [-n lines] [-r repeat] [-f format] [-l label] [-o dir] [--compare file]
+
+import sys
+import os
+import time
+import json
+import tempfile
+from subprocess import Popen, PIPE
+
+here = os.path.dirname(os.path.abspath(__file__))
+binDir = os.path.join(os.path.dirname(here), 'bin')
+sys.path.insert(0, here)
+import genlogs
+
+parsers = [
+    ('LaTexParser', 'latex'),
+    ('WatchDocumentParser', 'latex'),
+    ('ParseLatexMk', 'latexmk'),
+    ('BibTexParser', 'bibtex'),
+    ('ChkTeXParser', 'chktex'),
+]
+
+def cpuSeconds():
+    """User and system time of this process"""
+    user, system = os.times()[:2]
+    return user + system
+
+def maxrssKB():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024         # bytes on Mac OS X, kilobytes elsewhere
+    return rss
+
+def measure(parserName, logFile, format):
+    """Parse logFile once in this process, return the measurements"""
+    sys.path.insert(0, binDir)
+    import texparser
+    from texevents import EventSink, makeRenderer
+    baseline = maxrssKB()
+    if format == 'none':
+        sink = EventSink()
+    else:
+        sink = makeRenderer(format, open(os.devnull, 'w'))
+    parserClass = getattr(texparser, parserName)
+    stream = open(logFile)
+    if parserName == 'BibTexParser':
+        parser = parserClass(stream, False, sink)
+    else:
+        parser = parserClass(stream, False, 'paper.tex', sink)
+    start = time.time()
+    cpuStart = cpuSeconds()
+    fatal, errors, warnings = parser.parseStream()
+    return {'seconds' : time.time() - start, 'cpu' : cpuSeconds() - cpuStart,
+            'maxrss' : maxrssKB(), 'baselineRss' : baseline,
+            'errors' : errors, 'warnings' : warnings}
+
+def runChild(parserName, logFile, format):
+    """Measure in a fresh interpreter"""
+    child = Popen([sys.executable, __file__, '--child', parserName, logFile, format], stdout=PIPE)
+    output = child.stdout.read()
+    if child.wait() != 0:
+        raise RuntimeError('%s failed on %s' % (parserName, logFile))
+    return json.loads(output)
+
+def logFiles(kind, lines, tmpdir):
+    """The generated log for kind, and the recorded ones"""
+    generated = os.path.join(tmpdir, 'generated-%s.log' % kind)
+    if not os.path.exists(generated):
+        f = open(generated, 'w')
+        f.write(genlogs.generate(kind, lines))
+        f.close()
+    files = [('generated', generated)]
+    logDir = os.path.join(here, 'logs')
+    if os.path.isdir(logDir):
+        for name in sorted(os.listdir(logDir)):
+            if name.startswith(kind + '-') and name.endswith('.log'):
+                files.append((name, os.path.join(logDir, name)))
+    return files
+
+def benchmark(lines, repeat, format):
+    results = []
+    tmpdir = tempfile.mkdtemp(prefix='texparser-bench')
+    try:
+        for parserName, kind in parsers:
+            for logName, logFile in logFiles(kind, lines, tmpdir):
+                numLines = len(open(logFile).readlines())
+                runs = [runChild(parserName, logFile, format) for i in range(repeat)]
+                best = min(runs, key=lambda r: r['seconds'])
+                best.update({'parser' : parserName, 'log' : logName, 'lines' : numLines,
+                             'linesPerSecond' : numLines / max(best['seconds'], 1e-9),
+                             'maxrss' : max([r['maxrss'] for r in runs])})
+                results.append(best)
+                sys.stderr.write('%-20s %-22s %8d lines %10.0f lines/s %8d KB\n' % (
+                    parserName, logName, numLines, best['linesPerSecond'], best['maxrss']))
+    finally:
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+    return results
+
+def compare(results, oldFile, threshold):
+    """Print the speed of results relative to those in oldFile.  Returns the
+       number of slowdowns beyond threshold."""
+    old = json.load(open(oldFile))
+    before = dict([((r['parser'], r['log']), r) for r in old['results']])
+    slower = 0
+    print 'Compared with %s (%s):' % (old['label'], oldFile)
+    for r in results:
+        o = before.get((r['parser'], r['log']))
+        if not o:
+            continue
+        ratio = r['linesPerSecond'] / o['linesPerSecond']
+        mark = ''
+        if ratio < 1 - threshold:
+            mark = '  <-- slower'
+            slower += 1
+        print '%-20s %-22s %6.2fx speed %6.2fx memory%s' % (r['parser'], r['log'], ratio,
+            float(r['maxrss']) / max(o['maxrss'], 1), mark)
+    return slower
+
+def defaultLabel():
+    """The current git revision, or the date"""
+    try:
+        git = Popen(['git', 'describe', '--always', '--dirty'], cwd=here, stdout=PIPE, stderr=PIPE)
+        label = git.stdout.read().strip()
+        if git.wait() == 0 and label:
+            return label
+    except OSError:
+        pass
+    return time.strftime('%Y%m%d-%H%M%S')
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        print json.dumps(measure(*sys.argv[2:5]))
+        sys.exit(0)
+    from optparse import OptionParser
+    optParser = OptionParser(usage="%prog [options]")
+    optParser.add_option('-n', '--lines', type='int', default=20000, help="lines per generated log")
+    optParser.add_option('-r', '--repeat', type='int', default=3, help="runs per measurement, the best one counts")
+    optParser.add_option('-f', '--format', default='none', choices=['none', 'html', 'json', 'text'],
+                         help="renderer for the events, none to measure the parsers alone")
+    optParser.add_option('-l', '--label', help="name of the result file, the git revision by default")
+    optParser.add_option('-o', '--output', metavar='DIR',
+                         help="directory for the result file, benchmarks in the cache directory by default")
+    optParser.add_option('--compare', metavar='FILE', help="earlier result file to compare with")
+    optParser.add_option('--threshold', type='float', default=0.1, help="slowdown reported as a regression")
+    options, args = optParser.parse_args()
+
+    results = benchmark(options.lines, options.repeat, options.format)
+    label = options.label or defaultLabel()
+    resultDir = options.output
+    if not resultDir:
+        sys.path.insert(0, binDir)
+        from cachestore import cacheDir
+        resultDir = os.path.join(cacheDir(), 'benchmarks')
+    if not os.path.isdir(resultDir):
+        os.makedirs(resultDir)
+    resultFile = os.path.join(resultDir, label + '.json')
+    f = open(resultFile, 'w')
+    json.dump({'label' : label, 'date' : time.strftime('%Y-%m-%d %H:%M:%S'), 'python' : sys.version.split()[0],
+               'platform' : sys.platform, 'lines' : options.lines, 'format' : options.format,
+               'results' : results}, f, indent=1, sort_keys=True)
+    f.close()
+    print 'Results saved in', resultFile
+    if options.compare and compare(results, options.compare, options.threshold):
+        sys.exit(1)
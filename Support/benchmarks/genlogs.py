@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Synthetic logs for the parser benchmarks.
+#
+# Generates pdflatex, bibtex, latexmk and chktex output of a given number of lines.  The
+# mix of messages can be changed with --mix; the names are the keys of the mix dictionaries
+# below.  TeX breaks log lines at 79 characters, so long messages (file names, overfull box
+# contents) are wrapped the same way, which exercises getRewrappedLine.
+#
+# Usage: genlogs.py [-k kind] [-n lines] [-s seed] [--mix name=weight,...] [output]
+
+import sys
+import random
+
+kinds = ('latex', 'bibtex', 'latexmk', 'chktex')
+
+latexMix = {
+    'text' : 40,            # font and file loading chatter nobody cares about
+    'file' : 6,
+    'overfull' : 10,
+    'underfull' : 10,
+    'reference' : 8,
+    'citation' : 6,
+    'pdftex' : 3,
+    'font' : 3,
+    'error' : 2,
+    'oldError' : 2,
+    'runaway' : 1,
+    'longPath' : 6,
+    'use' : 3,
+}
+
+bibtexMix = {
+    'database' : 80,
+    'noEntry' : 20,
+}
+
+chktexMix = {
+    'warning' : 85,
+    'error' : 15,
+}
+
+mixes = {'latex' : latexMix, 'bibtex' : bibtexMix, 'latexmk' : latexMix, 'chktex' : chktexMix}
+
+words = ('lemma', 'theorem', 'proof', 'section', 'figure', 'table', 'equation',
+         'knuth', 'lamport', 'turing', 'hilbert', 'noether', 'euler', 'gauss')
+
+def wrap(line):
+    """Break line into 79 character pieces, as TeX does"""
+    pieces = []
+    while len(line) > 79:
+        pieces.append(line[:79])
+        line = line[79:]
+    pieces.append(line)
+    return pieces
+
+def choose(rnd, mix):
+    total = sum(mix.values())
+    n = rnd.uniform(0, total)
+    for name in sorted(mix.keys()):
+        n -= mix[name]
+        if n <= 0:
+            return name
+    return name
+
+def label(rnd):
+    return '%s:%s%d' % (rnd.choice(('fig', 'tab', 'eq', 'sec')), rnd.choice(words), rnd.randint(1, 500))
+
+def latexMessage(rnd, name, lineNo):
+    """Lines for one message of type name"""
+    if name == 'text':
+        return ['(/usr/local/texlive/2020/texmf-dist/tex/latex/base/size1%d.clo)' % rnd.randint(0, 2),
+                '[%d]' % rnd.randint(1, 300)]
+    if name == 'file':
+        return ['(./chapter%d.tex' % rnd.randint(1, 30)]
+    if name == 'overfull':
+        return wrap('Overfull \\hbox (%.5fpt too wide) in paragraph at lines %d--%d' % (rnd.uniform(0, 40), lineNo, lineNo + 2)) + \
+               wrap('[]\\OT1/cmr/m/n/10 ' + ' '.join([rnd.choice(words) for i in range(rnd.randint(5, 40))])) + ['']
+    if name == 'underfull':
+        return ['Underfull \\hbox (badness %d) in paragraph at lines %d--%d' % (rnd.randint(1000, 10000), lineNo, lineNo + 3), '']
+    if name == 'reference':
+        return wrap("LaTeX Warning: Reference `%s' on page %d undefined on input line %d." % (label(rnd), rnd.randint(1, 300), lineNo))
+    if name == 'citation':
+        return wrap("LaTeX Warning: Citation `%s%d' on page %d undefined on input line %d." % (rnd.choice(words), rnd.randint(1900, 2020), rnd.randint(1, 300), lineNo))
+    if name == 'pdftex':
+        return ['./paper.tex:%d: pdfTeX warning (ext4): destination with the same identifier (name{page.%d}) has been already used, duplicate ignored' % (lineNo, rnd.randint(1, 9))]
+    if name == 'font':
+        return ["LaTeX Font Warning: Font shape `OT1/cmr/bx/sc' undefined", '(Font)              using `OT1/cmr/bx/n\' instead on input line %d.' % lineNo]
+    if name == 'error':
+        return ['./chapter%d.tex:%d: Undefined control sequence.' % (rnd.randint(1, 30), lineNo),
+                'l.%d \\%s' % (lineNo, rnd.choice(words)), '']
+    if name == 'oldError':
+        return ['! Missing $ inserted.', '<inserted text> ', '                $', 'l.%d' % lineNo, '']
+    if name == 'runaway':
+        return ['Runaway argument?', '{' + ' '.join([rnd.choice(words) for i in range(8)]),
+                './paper.tex:%d: Paragraph ended before \\textbf was complete.' % lineNo, '']
+    if name == 'longPath':
+        return wrap('(/usr/local/texlive/2020/texmf-dist/tex/latex/%s/%s-%s-definitions-for-a-rather-long-package-name.sty' % (rnd.choice(words), rnd.choice(words), rnd.choice(words)) + ' ' * rnd.randint(0, 30) + ')')
+    if name == 'use':
+        return ['<use figures/%s%d.pdf>' % (rnd.choice(words), rnd.randint(1, 99))]
+    raise KeyError(name)
+
+def latexLog(rnd, lines, mix):
+    out = ['This is pdfTeX, Version 3.14159265-2.6-1.40.21 (TeX Live 2020) (preloaded format=pdflatex)',
+           'entering extended mode', '(./paper.tex', 'LaTeX2e <2020-02-02> patch level 5',
+           'Document Class: article 2019/12/20 v1.4l Standard LaTeX document class']
+    while len(out) < lines:
+        out += latexMessage(rnd, choose(rnd, mix), len(out))
+    out += ['Output written on paper.pdf (%d pages, %d bytes).' % (rnd.randint(1, 300), rnd.randint(10000, 9999999)),
+            'Transcript written on paper.log.']
+    return out
+
+def bibtexLog(rnd, lines, mix):
+    out = ['This is BibTeX, Version 0.99d (TeX Live 2020)', 'The top-level auxiliary file: paper.aux',
+           'The style file: plain.bst']
+    while len(out) < lines:
+        if choose(rnd, mix) == 'database':
+            out.append('Database file #%d: refs%d.bib' % (rnd.randint(1, 9), rnd.randint(1, 9)))
+        else:
+            out.append("Warning--I didn't find a database entry for \"%s%d\"" % (rnd.choice(words), rnd.randint(1900, 2020)))
+    out.append('(There were %d warnings)' % rnd.randint(1, 99))
+    return out
+
+def latexmkLog(rnd, lines, mix):
+    """latexmk running pdflatex and bibtex a few times"""
+    out = ['Latexmk: This is Latexmk, John Collins, 26 Dec. 2019, version: 4.67.']
+    runs = 3
+    for run in range(1, runs + 1):
+        out += ["Latexmk: applying rule 'pdflatex'...", "Run number %d of rule 'pdflatex'" % run,
+                "Running 'pdflatex  -interaction=nonstopmode -recorder  \"paper.tex\"'"]
+        out += latexLog(rnd, lines / (runs + 1), mix)
+        if run == 1:
+            out += ["Latexmk: applying rule 'bibtex paper'...", "Run number 1 of rule 'bibtex paper'"]
+            out += bibtexLog(rnd, lines / (runs + 1) / 4, bibtexMix) + ['---']
+    out.append('Latexmk: All targets (paper.pdf) are up-to-date')
+    return out
+
+def chktexLog(rnd, lines, mix):
+    out = ['ChkTeX v1.7.6 - Copyright 1995-96 Jens T. Berger Thielemann.']
+    while len(out) < lines:
+        lineNo = rnd.randint(1, 5000)
+        if choose(rnd, mix) == 'warning':
+            out.append('Warning %d in chapter%d.tex line %d: Delete this space to maintain correct pagereferences.' % (rnd.randint(1, 40), rnd.randint(1, 30), lineNo))
+        else:
+            out.append("Error %d in chapter%d.tex line %d: `}' expected, found `)'." % (rnd.randint(1, 40), rnd.randint(1, 30), lineNo))
+        out += [' \\label{%s} ' % label(rnd), ' ' * rnd.randint(1, 20) + '^']
+    return out
+
+generators = {'latex' : latexLog, 'bibtex' : bibtexLog, 'latexmk' : latexmkLog, 'chktex' : chktexLog}
+
+def generate(kind, lines=10000, seed=0, mix=None):
+    """Return the text of a log of kind with about lines lines.  mix overrides
+       weights of the default mix for kind."""
+    weights = mixes[kind].copy()
+    weights.update(mix or {})
+    return '\n'.join(generators[kind](random.Random(seed), lines, weights)) + '\n'
+
+def parseMix(text):
+    """'overfull=50,error=0' -> {'overfull': 50.0, 'error': 0.0}"""
+    mix = {}
+    for item in text.split(','):
+        if item.strip():
+            name, weight = item.split('=')
+            mix[name.strip()] = float(weight)
+    return mix
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    optParser = OptionParser(usage="%prog [options] [output]")
+    optParser.add_option('-k', '--kind', default='latex', choices=kinds, help="one of " + ', '.join(kinds))
+    optParser.add_option('-n', '--lines', type='int', default=10000, help="approximate number of lines")
+    optParser.add_option('-s', '--seed', type='int', default=0)
+    optParser.add_option('--mix', default='', help="message weights, e.g. overfull=50,error=0")
+    options, args = optParser.parse_args()
+    text = generate(options.kind, options.lines, options.seed, parseMix(options.mix))
+    if args:
+        f = open(args[0], 'w')
+        f.write(text)
+        f.close()
+    else:
+        sys.stdout.write(text)
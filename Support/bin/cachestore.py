@@ -0,0 +1,88 @@
+import os
+import marshal
+import tempfile
+
+# Small on-disk caches shared by the LaTeX commands.
+#
+# Each cache is a marshalled dictionary in a per-user cache directory.  Files are replaced
+# atomically, so two builds running at once can never read a half written cache; the worst
+# that can happen is that one of them loses its update and recomputes it next time.
+
+def cacheDir():
+	"""Return (and create) the directory for cache files.  TM_LATEX_CACHE_DIR overrides
+	   the default of ~/Library/Caches/com.macromates.textmate.latex-debug"""
+	path = os.getenv('TM_LATEX_CACHE_DIR')
+	if not path:
+		path = os.path.expanduser('~/Library/Caches/com.macromates.textmate.latex-debug')
+	if not os.path.isdir(path):
+		try:
+			os.makedirs(path)
+		except OSError:
+			pass
+	return path
+
+def fileSignature(path):
+	"""(mtime, size) of path, or None if it cannot be stat'ed"""
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return (st.st_mtime, st.st_size)
+
+try:
+	from hashlib import md5
+except ImportError:
+	from md5 import new as md5
+
+def hashFile(path):
+	"""Hex digest of the contents of path, or None if it cannot be read"""
+	try:
+		f = open(path, 'rb')
+	except IOError:
+		return None
+	digest = md5()
+	while True:
+		block = f.read(65536)
+		if not block:
+			break
+		digest.update(block)
+	f.close()
+	return digest.hexdigest()
+
+def hashString(s):
+	return md5(s).hexdigest()
+
+
+class CacheFile(object):
+	"""A dictionary stored in the cache directory under name"""
+	def __init__(self, name, directory=None):
+		super(CacheFile, self).__init__()
+		self.path = os.path.join(directory or cacheDir(), name + '.cache')
+
+	def load(self):
+		"""Return the stored dictionary, or an empty one if there is none or it is unreadable"""
+		try:
+			f = open(self.path, 'rb')
+			try:
+				data = marshal.load(f)
+			finally:
+				f.close()
+		except (IOError, EOFError, ValueError, TypeError):
+			return {}
+		if not isinstance(data, dict):
+			return {}
+		return data
+
+	def save(self, data):
+		"""Atomically replace the stored dictionary.  Failing to write a cache is not an error."""
+		try:
+			fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.tmp')
+			f = os.fdopen(fd, 'wb')
+			marshal.dump(data, f)
+			f.close()
+			os.rename(tmp, self.path)
+		except (IOError, OSError, ValueError):
+			try:
+				os.remove(tmp)
+			except (OSError, NameError):
+				pass
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# File watcher for Watch Document.
+#
+# latex_watch.pl used to wake up every half second and stat every file TeX had recorded.  This
+# process waits for changes instead and tells latex_watch.pl about them as they happen.  On
+# Linux it asks inotify (through ctypes) about the directories of the watched files, so that
+# editors that save by writing a new file and renaming it over the old one are noticed too.
+# Where inotify is not available it falls back to comparing mtime and size every
+# pollInterval seconds.
+#
+# Protocol: commands are read from stdin, one per line
+#       watch <TAB> path        add path to the watched files
+#       reset                   forget all watched files
+# For every batch of changes the watcher writes one line per changed file to stdout
+#       changed <TAB> path
+# with path as it was given.  The watcher exits when stdin is closed.
+
+import sys
+import os
+import errno
+import select
+import struct
+import time
+from cachestore import fileSignature
+
+pollInterval = 0.5
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+watchMask = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class InotifyWatcher(object):
+    """Watch files through inotify watches on their directories"""
+    interval = None
+
+    def __init__(self):
+        super(InotifyWatcher, self).__init__()
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.getErrno = ctypes.get_errno
+        self.fd = self.libc.inotify_init()      # AttributeError if there is no inotify
+        if self.fd < 0:
+            raise OSError(self.getErrno(), 'inotify_init failed')
+        self.files = {}         # absolute path -> path as given
+        self.dirs = {}          # directory -> watch descriptor
+        self.wds = {}           # watch descriptor -> directory
+
+    def fileno(self):
+        return self.fd
+
+    def watch(self, path):
+        full = os.path.abspath(path)
+        self.files[full] = path
+        directory = os.path.dirname(full)
+        if directory in self.dirs:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, directory, watchMask)
+        if wd < 0:
+            return          # the directory is gone, nothing can change in it
+        self.dirs[directory] = wd
+        self.wds[wd] = directory
+
+    def reset(self):
+        """Forget the files.  The directory watches are kept, the next set of
+           files is usually almost the same."""
+        self.files = {}
+
+    def changes(self):
+        """Read the pending events, return the watched files they are about"""
+        try:
+            buf = os.read(self.fd, 65536)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                return []
+            raise
+        changed = []
+        i = 0
+        while i + 16 <= len(buf):
+            wd, mask, cookie, length = struct.unpack('iIII', buf[i:i+16])
+            name = buf[i+16:i+16+length].rstrip('\0')
+            i += 16 + length
+            if mask & IN_Q_OVERFLOW:
+                return self.files.values()
+            directory = self.wds.get(wd)
+            if directory is None:
+                continue
+            path = self.files.get(os.path.join(directory, name))
+            if path is not None and path not in changed:
+                changed.append(path)
+        return changed
+
+
+class PollingWatcher(object):
+    """Watch files by comparing their mtime and size every pollInterval seconds"""
+    interval = pollInterval
+
+    def __init__(self):
+        super(PollingWatcher, self).__init__()
+        self.files = {}         # path -> signature
+
+    def fileno(self):
+        return None
+
+    def watch(self, path):
+        self.files[path] = fileSignature(path)
+
+    def reset(self):
+        self.files = {}
+
+    def changes(self):
+        changed = []
+        for path, sig in self.files.items():
+            current = fileSignature(path)
+            if current != sig:
+                self.files[path] = current
+                changed.append(path)
+        return changed
+
+
+def makeWatcher():
+    """An InotifyWatcher if the system has inotify, a PollingWatcher otherwise"""
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError, ImportError):
+        return PollingWatcher()
+
+def command(watcher, line):
+    if line == 'reset':
+        watcher.reset()
+    elif line.startswith('watch\t'):
+        watcher.watch(line[len('watch\t'):])
+
+def serve(watcher, input=0, output=sys.stdout):
+    """Read commands from the file descriptor input and report changes on output
+       until input is closed"""
+    pending = ''
+    fds = [input]
+    if watcher.fileno() is not None:
+        fds.append(watcher.fileno())
+    lastPoll = time.time()
+    while True:
+        try:
+            ready = select.select(fds, [], [], watcher.interval)[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        if input in ready:
+            data = os.read(input, 65536)
+            if not data:
+                break
+            lines = (pending + data).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                command(watcher, line)
+        changed = []
+        if watcher.interval is None:
+            if watcher.fileno() in ready:
+                changed = watcher.changes()
+        elif time.time() - lastPoll >= watcher.interval:
+            changed = watcher.changes()
+            lastPoll = time.time()
+        if changed:
+            output.write(''.join(['changed\t%s\n' % path for path in changed]))
+            output.flush()
+
+if __name__ == '__main__':
+    serve(makeWatcher())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Shared cache of precompiled preamble formats.
+#
+# Dumping a preamble into a format file makes every later compile start after \begin{document},
+# but building the format costs as much as a complete run.  Documents that use the same class
+# and packages can share formats, so they are kept in one cache directory for the user.
+#
+# A format is looked up by the hash of the preamble text, the engine and the engine's version.
+# The files TeX read while building it (from its -recorder list) are stored with the format, and
+# a format is only used when none of them changed.  Files named relative to the document's
+# directory are checked relative to the directory of the document asking.  When the cache grows
+# beyond maxSize bytes the least recently used formats are removed.
+#
+# Usage from other programs:
+#       fmtcache.py lookup engine textfile fmtfile flsfile
+#           copy the format (and its file list) for the text in textfile to fmtfile and flsfile;
+#           exits with status 1 if there is none
+#       fmtcache.py store engine textfile fmtfile flsfile
+#           add fmtfile, built from textfile, to the cache
+# engine is the command used to build the format, e.g. "pdfetex -output-format pdf &pdflatex".
+
+import sys
+import os
+import time
+import shutil
+from cachestore import CacheFile, cacheDir, fileSignature, hashFile, hashString
+from texengine import engineCapabilities
+
+maxSize = int(os.getenv('TM_LATEX_FORMAT_CACHE_SIZE') or 512) * 1024 * 1024
+
+
+class FormatCache(object):
+    """Formats in the formats directory of the cache directory, with an index
+       holding their inputs and the time they were last used"""
+    def __init__(self, directory=None, maxSize=maxSize):
+        super(FormatCache, self).__init__()
+        self.directory = directory or os.path.join(cacheDir(), 'formats')
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                pass
+        self.index = CacheFile('index', self.directory)
+        self.maxSize = maxSize
+
+    def key(self, text, engine):
+        """The cache key for a format built by engine from text, None if the
+           engine is not installed"""
+        caps = engineCapabilities(engine)
+        if not caps:
+            return None
+        return hashString('\0'.join((text, engine, caps['version'])))
+
+    def inputsUnchanged(self, inputs):
+        for path, (sig, digest) in inputs.items():
+            if fileSignature(path) != sig and hashFile(path) != digest:
+                return False
+        return True
+
+    def lookup(self, key):
+        """Return the paths of the format and its file list for key, or None"""
+        entries = self.index.load()
+        entry = entries.get(key)
+        if not entry:
+            return None
+        fmtFile = os.path.join(self.directory, key + '.fmt')
+        if not os.path.exists(fmtFile) or not self.inputsUnchanged(entry['inputs']):
+            return None
+        entry['used'] = time.time()
+        self.index.save(entries)
+        return fmtFile, os.path.join(self.directory, key + '.fls')
+
+    def store(self, key, fmtFile, flsFile, source):
+        """Copy fmtFile and flsFile into the cache under key.  The inputs are read
+           from flsFile, leaving out source (the file the format was built from)
+           and the files the run wrote.  Returns the path of the cached format."""
+        inputs = {}
+        outputs = {}
+        cwd = os.getcwd()
+        lines = open(flsFile).read().split('\n')
+        for line in lines:
+            if line.startswith('PWD '):
+                cwd = line[4:]
+            elif line.startswith('OUTPUT '):
+                outputs[os.path.normpath(os.path.join(cwd, line[7:]))] = True
+        source = os.path.normpath(os.path.join(os.getcwd(), source))
+        for line in lines:
+            if not line.startswith('INPUT '):
+                continue
+            name = line[6:]
+            path = os.path.normpath(os.path.join(cwd, name))
+            if path == source or path in outputs:
+                continue
+            if not os.path.isabs(name):
+                name = os.path.normpath(name)       # checked relative to the document asking
+            sig = fileSignature(path)
+            if sig:
+                inputs[name] = (sig, hashFile(path))
+        target = os.path.join(self.directory, key + '.fmt')
+        tmp = target + '.%d' % os.getpid()
+        shutil.copyfile(fmtFile, tmp)
+        os.rename(tmp, target)
+        shutil.copyfile(flsFile, os.path.join(self.directory, key + '.fls'))
+        entries = self.index.load()
+        entries[key] = {'inputs' : inputs, 'used' : time.time(), 'size' : os.path.getsize(target)}
+        self.evict(entries, key)
+        self.index.save(entries)
+        return target
+
+    def evict(self, entries, keep=None):
+        """Remove least recently used formats until the cache fits in maxSize"""
+        total = sum([e['size'] for e in entries.values()])
+        for used, key in sorted([(e['used'], k) for k, e in entries.items()]):
+            if total <= self.maxSize:
+                break
+            if key == keep:
+                continue
+            total -= entries[key]['size']
+            del entries[key]
+            for suffix in ('.fmt', '.fls'):
+                try:
+                    os.remove(os.path.join(self.directory, key + suffix))
+                except OSError:
+                    pass
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 6 or sys.argv[1] not in ('lookup', 'store'):
+        sys.stderr.write("Usage: %s lookup|store engine textfile fmtfile flsfile\n" % sys.argv[0])
+        sys.exit(2)
+    action, engine, textFile, fmtFile, flsFile = sys.argv[1:]
+    cache = FormatCache()
+    key = cache.key(open(textFile).read(), engine)
+    if key is None:
+        sys.exit(1)
+    if action == 'lookup':
+        found = cache.lookup(key)
+        if not found:
+            sys.exit(1)
+        shutil.copyfile(found[0], fmtFile)
+        shutil.copyfile(found[1], flsFile)
+    else:
+        cache.store(key, fmtFile, flsFile, textFile)
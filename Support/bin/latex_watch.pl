@@ -22,7 +22,12 @@
 use strict;
 use warnings;
 use POSIX ();
+use Time::HiRes ();
 use File::Copy 'copy';
+use Digest::MD5;
+use IO::Socket::UNIX;
+use IO::Handle;
+use IPC::Open2;
 use Getopt::Long qw(GetOptions :config no_auto_abbrev bundling);
 
 
@@ -119,6 +124,10 @@ sub get_prefs {
 		engine  => getPreference(latexEngine => "pdflatex"),
 		options => getPreference(latexEngineOptions => ""),
 		viewer  => getPreference(latexViewer => "TextMate"),
+		# Parse TeX's output while it is compiling, instead of the log afterwards
+		streaming => getPreference(latexWatchStreaming => "1"),
+		# Seconds without further saves before a change is compiled
+		debounce  => getPreference(latexWatchDebounce => "0.15"),
 	);
 }
 
@@ -207,6 +216,7 @@ sub parse_file_path {
 
 # Persistent state
 my ($preamble, $bogus_preamble, %preamble_mtimes, %body_mtimes, $cleanup_viewer, $ping_viewer);
+my $compile_cancelled;	# set when a change interrupted the compile, so the next round restarts it
 
 
 #############
@@ -215,8 +225,12 @@ my ($preamble, $bogus_preamble, %preamble_mtimes, %body_mtimes, $cleanup_viewer,
 
 sub main_loop {
 	my $ping_counter = 10;
+	my $notified = 1;
+	start_file_watcher();
 	while(1) {
-		if (document_has_changed()) {
+		wait_for_quiet() if $notified;
+		if ($compile_cancelled or ($notified and document_has_changed())) {
+			undef $compile_cancelled;
 			debug_msg("Reloading file");
 			
 			print "<div id=\"processing\">";
@@ -224,6 +238,7 @@ sub main_loop {
 			print "<p class=\"info\">Processing...</p></div>";
 			reload();
 			compile() and view();
+			update_file_watcher();
 			if (defined ($progressbar_pid)) {
 				debug_msg("Closing progress bar window ($progressbar_pid)");
 				kill(15, $progressbar_pid) or fail("Failed to close progress bar window: $!");
@@ -246,10 +261,69 @@ sub main_loop {
 				};
 		}
 
-		select(undef, undef, undef, 0.5); # Sleep for 0.5 seconds
+		$notified = $compile_cancelled || wait_for_change(0.5);
 	}
 }
 
+# filewatch.py tells us when one of the recorded dependencies changes, so
+# the files are only stat'ed after a save. Without it we poll as before.
+my ($watcher_pid, $watcher_in, $watcher_out);
+sub start_file_watcher {
+	$watcher_pid = eval {
+		open2($watcher_out, $watcher_in, "python", "$ENV{TM_BUNDLE_SUPPORT}/bin/filewatch.py")
+	};
+	if (!$watcher_pid) {
+		debug_msg("Failed to start the file watcher, polling instead");
+		return;
+	}
+	$watcher_in->autoflush(1);
+}
+
+sub update_file_watcher {
+	return if !$watcher_pid;
+	local $SIG{PIPE} = 'IGNORE';	# a watcher that died must not take us with it
+	print $watcher_in "reset\n", map("watch\t$_\n", keys(%preamble_mtimes), keys(%body_mtimes))
+		or stop_file_watcher("Failed to write to the file watcher ($!), polling instead");
+}
+
+# Reap the watcher and fall back to polling
+sub stop_file_watcher {
+	my ($reason) = @_;
+	debug_msg($reason);
+	local $SIG{PIPE} = 'IGNORE';
+	close($watcher_in) or debug_msg("Failed to close the file watcher's input: $!");
+	close($watcher_out);
+	waitpid($watcher_pid, 0);
+	undef $watcher_pid;
+}
+
+# Several saves in a row (or a file being written in pieces) should give
+# one compile of the final content, so wait until things have settled.
+sub wait_for_quiet {
+	my $deadline = Time::HiRes::time() + 1;	# don't wait forever on a file that keeps changing
+	while ($watcher_pid and Time::HiRes::time() < $deadline
+		and wait_for_change($prefs{debounce})) { }
+}
+
+# Wait up to $timeout seconds. Returns true if the dependencies should be checked.
+sub wait_for_change {
+	my ($timeout) = @_;
+	if (!$watcher_pid) {
+		select(undef, undef, undef, $timeout);
+		return 1;
+	}
+	my $rin = "";
+	vec($rin, fileno($watcher_out), 1) = 1;
+	return 0 if select(my $rout = $rin, undef, undef, $timeout) <= 0;
+	my $changes;
+	if (!sysread($watcher_out, $changes, 65536)) {
+		stop_file_watcher("The file watcher has exited, polling instead");
+		return 1;
+	}
+	debug_msg("File watcher reports", $changes);
+	return 1;
+}
+
 ####################
 # Cleanup routines #
 ####################
@@ -306,16 +380,26 @@ sub document_has_changed {
 	return $change;
 }
 
+# A newer mtime alone does not make a file modified: touch, git checkout
+# or saving without changes leave the contents as they were. Those files
+# only get their new mtime recorded.
 sub foreach_modified_file {
 	my ($hash, $callback) = @_;
 	
 	while (my ($file, $mtime) = each %$hash) {
 		my $current_mtime = -M $file;
-		if (!defined($current_mtime)	# Error: probably input file moved or deleted
+		if (defined($current_mtime) && $current_mtime < $mtime
+		  && contents_unchanged($file))
+		{
+			debug_msg("The file '$file' was touched but has not changed.");
+			$hash->{$file} = $current_mtime;
+		}
+		elsif (!defined($current_mtime)	# Error: probably input file moved or deleted
 		  || $current_mtime < $mtime)
 		{
 			if (defined $current_mtime) {
 				$hash->{$file} = $current_mtime;
+				remember_contents($file);
 			}
 			else {
 				delete $hash->{$file};
@@ -325,6 +409,30 @@ sub foreach_modified_file {
 	}
 }
 
+# Size and MD5 digest of each watched file, taken when its mtime was recorded
+my %file_contents;
+
+sub file_digest {
+	my ($file) = @_;
+	open(my $f, "<", $file) or return;
+	binmode $f;
+	return Digest::MD5->new->addfile($f)->hexdigest;
+}
+
+sub remember_contents {
+	my ($file) = @_;
+	$file_contents{$file} = [ -s $file || 0, file_digest($file) ];
+}
+
+# Cheap test first: a different size means a different file
+sub contents_unchanged {
+	my ($file) = @_;
+	my $known = $file_contents{$file} or return 0;
+	return 0 if (-s $file || 0) != $known->[0] or !defined $known->[1];
+	my $digest = file_digest($file);
+	return defined($digest) && $digest eq $known->[1];
+}
+
 sub reload {
 	open (my $f, "<", $filepath)
 		or fail ("Failed to open file",
@@ -404,12 +512,23 @@ sub regenerate_format {
 
 	copy("$wd/$name.bbl", "$wd/$dotname.bbl"); # Ignore errors
 	unlink("$wd/$dotname.fmt"); # Ignore errors
+
+	# Another document (or an earlier session) may have dumped the same preamble
+	my @format_cache = ("python", "$ENV{TM_BUNDLE_SUPPORT}/bin/fmtcache.py");
+	my @format_key = (join(" ", @tex, "&$base_format"), "$wd/$dotname.ini", "$wd/$dotname.fmt", "$wd/$dotname.fls");
+	if (system(@format_cache, "lookup", @format_key) == 0) {
+		debug_msg("Using the cached format for this preamble");
+		parse_file_list(\%preamble_mtimes);
+		return;
+	}
+	my $format_failed;
 	fail_unless_system(@tex, "-ini",
 		-interaction => "batchmode", "-synctex=1",
 		"-recorder", "-file-line-error","&".$base_format,  #+(be silent) added "-file-line-error"
         #-fmt => "$dotname", # Vielleicht braucht man das hier auch
 		qq("$wd/$dotname.ini"),
 	sub {
+		$format_failed = 1;
 		#+ be silent
 		parse_log_file("preamble","$dotname.ini");  #+
 		
@@ -431,6 +550,8 @@ sub regenerate_format {
 		# 					exit;
 		# 				}
 	});
+	system(@format_cache, "store", @format_key)
+		if !$format_failed and -e "$wd/$dotname.fmt";
 	parse_file_list(\%preamble_mtimes);
 }
 
@@ -441,7 +562,7 @@ sub parse_file_list {
 		or fail("Failed to open file list", "I couldn't open the file '$wd/$dotname.fls': $!");
 	local $/ = "\n";
 	
-	my %updated_files;
+	my (@inputs, %outputs);
 	while (<$f>) {
 		if (/^(INPUT|OUTPUT) (.*)/) {
 			my ($t, $f) = ($1, $2);
@@ -450,23 +571,11 @@ sub parse_file_list {
 			$f =~ s/(^|\Q$wd\E\/)\Q$dotname.\E(tex|bbl|aux)/$1$name.$2/;
 			$f = "$wd/$f" if $f !~ m(/);
 			
-			my $mtime = -M($f);
 			if ($t eq 'INPUT') {
-				if (defined $mtime) {
-					if (!exists $hash->{$f}) {
-						debug_msg("[x] $f");
-						$hash->{$f} = $mtime
-					}
-				}
-				else {
-					# Probably the file no longer exists. Warn but continue.
-					print("[LaTeX Watch] ",
-						"Failed to find the modification time of the file '$f'".
-						" while parsing the file list: $!\n");
-				}
+				push @inputs, $f;
 			}
 			else {	# $t eq 'OUTPUT'
-				$updated_files{$f} = $mtime;
+				$outputs{$f} = 1;
 			}
 		}
 		elsif (!/^PWD /) {
@@ -474,9 +583,28 @@ sub parse_file_list {
 		}
 	}
 	
-	while (my ($f, $mtime) = each %updated_files) {
-		$preamble_mtimes{$f} = $mtime if exists $preamble_mtimes{$f} and defined $mtime;
-		$hash->{$f} = $mtime if exists $hash->{$f} and defined $mtime;
+	# Files TeX writes as well as reads (.toc, .out, .lof, .lot, ...) change at
+	# the end of every run. They are not sources: watching them would cancel the
+	# compile that is writing them, so they are left out.
+	foreach my $f (keys %outputs) {
+		delete $hash->{$f};
+		delete $preamble_mtimes{$f};
+		delete $file_contents{$f};
+	}
+	foreach my $f (@inputs) {
+		next if exists $outputs{$f} or exists $hash->{$f};
+		my $mtime = -M($f);
+		if (defined $mtime) {
+			debug_msg("[x] $f");
+			$hash->{$f} = $mtime;
+			remember_contents($f);
+		}
+		else {
+			# Probably the file no longer exists. Warn but continue.
+			print("[LaTeX Watch] ",
+				"Failed to find the modification time of the file '$f'".
+				" while parsing the file list: $!\n");
+		}
 	}
 	debug_msg("Parsed file list: found ".keys(%$hash)." files");
 }
@@ -500,30 +628,40 @@ sub compile {
 	
 	unlink "$wd/$dotname.dvi";
 	my $error = 0;
-	fail_unless_system(@tex,
-		-interaction => "batchmode", "-synctex=1",
-		"-recorder", "-file-line-error", #+(be silent) added -file-line-error
-		-fmt => "$dotname", 
-		qq("$wd/$dotname.tex"),  
-	sub {
-		if ($? ==1 || $? == 2) {
-			# An error in the document
+	if ($prefs{streaming}) {
+		$error = stream_compile(@tex,
+			-interaction => "nonstopmode", "-synctex=1",
+			"-recorder", "-file-line-error",
+			-fmt => "$dotname",
+			qq("$wd/$dotname.tex"));
+		return if $error < 0;	# cancelled, a new compile follows
+	}
+	else {
+		fail_unless_system(@tex,
+			-interaction => "batchmode", "-synctex=1",
+			"-recorder", "-file-line-error", #+(be silent) added -file-line-error
+			-fmt => "$dotname", 
+			qq("$wd/$dotname.tex"),  
+		sub {
+			if ($? ==1 || $? == 2) {
+				# An error in the document
 			
-			# be silent
-			#- offer_to_show_log();
-			clear_html_output("processing");
-			#print '<div id="done"><p class="info">Error?.</p></div>';
-			parse_log_file("texbody","$dotname.tex"); #+
-			$error = 1;
-		}
-		else {
-			clear_html_output("processing");
-			#print '<div id="done"><p class="info">Fail?.</p></div>';
+				# be silent
+				#- offer_to_show_log();
+				clear_html_output("processing");
+				#print '<div id="done"><p class="info">Error?.</p></div>';
+				parse_log_file("texbody","$dotname.tex"); #+
+				$error = 1;
+			}
+			else {
+				clear_html_output("processing");
+				#print '<div id="done"><p class="info">Fail?.</p></div>';
 	
-			fail("Failed to compile document",
-				"The command '@_' exited with unexpected error code $?");
-		}
-	});
+				fail("Failed to compile document",
+					"The command '@_' exited with unexpected error code $?");
+			}
+		});
+	}
 	if ($error == 0) {
 #		print '';
 		clear_html_output("processing");
@@ -562,6 +700,138 @@ sub compile {
 	}
 }
 
+# Run TeX and show its errors as TeX reports them. The output goes to the log
+# parser server, which is running already, so no interpreter has to start and
+# no patterns have to be compiled for every compile; without the server it goes
+# through texparser.py --exec. TeX is stopped at the first fatal error.
+# Returns 1 if the document had errors. If the document changes while TeX is
+# running, TeX is killed and -1 is returned; the main loop then starts again
+# with the new content.
+sub stream_compile {
+	my @command = @_;
+	my $parser = connect_log_parser();
+	return stream_compile_exec(@command) if !defined $parser;
+	debug_msg("Compiling with output streamed to the log parser server", @command);
+	local $| = 1;
+	local $SIG{PIPE} = 'IGNORE';	# the server closes the connection at a fatal error
+	clear_html_output("processing");
+	print "<div id=\"texbody\">";
+	syswrite($parser, join("\t", "stream", $absolute_wd, "$dotname.tex")."\n");
+	my $pid = open(my $out, "-|");
+	fail("Failed to execute $command[0]",
+		"The command '@command' failed to execute: $!")
+		if !defined $pid;
+	if ($pid == 0) {
+		setpgrp(0, 0);	# so TeX can be killed with everything it started
+		open(STDERR, ">&STDOUT");
+		open(STDIN, "<", "/dev/null");
+		exec(@command) or POSIX::_exit(127);
+	}
+	# TeX's output is only read while nothing is waiting to go to the server,
+	# so neither side can block the other.
+	my ($pending, $status) = ("");
+	while (1) {
+		my ($rin, $win) = ("", "");
+		vec($rin, fileno($out), 1) = 1 if $out and $pending eq "";
+		vec($win, fileno($parser), 1) = 1 if $pending ne "";
+		vec($rin, fileno($parser), 1) = 1;
+		vec($rin, fileno($watcher_out), 1) = 1 if $watcher_pid;
+		next if select(my $rout = $rin, my $wout = $win, undef, undef) <= 0;
+		if ($watcher_pid and vec($rout, fileno($watcher_out), 1)
+			and wait_for_change(0) and document_has_changed())
+		{
+			debug_msg("The document changed while compiling, restarting");
+			kill(15, -$pid) if $out;
+			close $out if $out;
+			close $parser;
+			print "</div>";
+			$compile_cancelled = 1;
+			return -1;
+		}
+		if ($pending ne "" and vec($wout, fileno($parser), 1)) {
+			my $written = syswrite($parser, $pending);
+			$pending = defined $written ? substr($pending, $written) : "";
+		}
+		if ($out and vec($rout, fileno($out), 1)) {
+			if (!sysread($out, $pending, 65536)) {
+				close $out;
+				$status = $?;
+				undef $out;
+				shutdown($parser, 1);	# end of TeX's output
+			}
+		}
+		if (vec($rout, fileno($parser), 1)) {
+			my $html;
+			last if !sysread($parser, $html, 65536);
+			print $html;
+		}
+	}
+	close $parser;
+	if ($out) {	# the server stopped at a fatal error
+		debug_msg("Stopping TeX after a fatal error");
+		kill(15, -$pid);
+		close $out;
+		return 1;
+	}
+	return 1 if $status & 127;
+	$status >>= 8;
+	return 0 if $status == 0;
+	return 1 if $status == 1 || $status == 2;
+	fail("Failed to execute $command[0]",
+		"The command '@command' could not be run. Check the TeX engine in the preferences and your PATH")
+		if $status == 127;
+	fail("Failed to compile document",
+		"The command '@command' exited with unexpected error code $status");
+}
+
+# stream_compile without the log parser server: TeX runs under texparser.py --exec.
+sub stream_compile_exec {
+	my @command = @_;
+	debug_msg("Compiling with streamed output", @command);
+	local $| = 1;
+	clear_html_output("processing");
+	print "<div id=\"texbody\">";
+	my $pid = open(my $out, "-|");
+	fail("Failed to execute $command[0]",
+		"The command '@command' failed to execute: $!")
+		if !defined $pid;
+	if ($pid == 0) {
+		setpgrp(0, 0);	# so TeX can be killed together with the parser
+		exec("python", "$ENV{TM_BUNDLE_SUPPORT}/bin/texparser.py", "--exec", "$dotname.tex", @command)
+			or POSIX::_exit(127);
+	}
+	while (1) {
+		my $rin = "";
+		vec($rin, fileno($out), 1) = 1;
+		vec($rin, fileno($watcher_out), 1) = 1 if $watcher_pid;
+		next if select(my $rout = $rin, undef, undef, undef) <= 0;
+		if ($watcher_pid and vec($rout, fileno($watcher_out), 1)
+			and wait_for_change(0) and document_has_changed())
+		{
+			debug_msg("The document changed while compiling, restarting");
+			kill(15, -$pid);
+			close $out;
+			print "</div>";
+			$compile_cancelled = 1;
+			return -1;
+		}
+		if (vec($rout, fileno($out), 1)) {
+			my $output;
+			last if !sysread($out, $output, 4096);
+			print $output;
+		}
+	}
+	close $out;
+	my $status = $? >> 8;
+	return 0 if $status == 0;
+	return 1 if $status == 1 || $status == 2;
+	fail("Failed to execute $command[0]",
+		"The command '@command' could not be run. Check the TeX engine in the preferences and your PATH")
+		if $status == 127;	# texparser.py's engineNotRun, or python itself is missing
+	fail("Failed to compile document",
+		"The command '@command' exited with unexpected error code $status");
+}
+
 sub munge_pdfsync_file {
 	my $contents;
 	open(my $f, "<", "$wd/$dotname.pdfsync")
@@ -602,6 +872,19 @@ sub parse_log_file { #+
 	my $errors;
 	my $ls_cmd = "python \"$ENV{TM_BUNDLE_SUPPORT}/bin/texparser.py\" $wd/$dotname.log $texfilename";
 	print "<div id=\"$cssid\"><p class=\"info\">Error processing $cssid.</p>";
+
+	# Ask the log parser server first, it has the parser loaded already
+	my $parser = connect_log_parser();
+	if (defined $parser) {
+		print $parser join("\t", "parse", $absolute_wd, "$wd/$dotname.log", $texfilename), "\n";
+		while (<$parser>) {
+			print $_;
+		}
+		close $parser;
+		return;
+	}
+
+	# Fall back to a one-shot parser process
 	 open(LS_CMD, "$ls_cmd |") or die "Can't run '$ls_cmd'\n$!\n";
 	 	while(<LS_CMD>){
 				$errors = $_;
@@ -617,6 +900,24 @@ sub parse_log_file { #+
 	
 }
 
+# Connect to texparserd.py, starting it if it isn't running. Returns undef if that fails.
+my $log_parser_started;
+sub log_parser_socket {
+	my $tmpdir = $ENV{TMPDIR} || "/tmp";
+	$tmpdir =~ s!/+$!!;
+	return "$tmpdir/texparserd-$<.sock";
+}
+
+sub connect_log_parser {
+	my $socket = IO::Socket::UNIX->new(Peer => log_parser_socket());
+	return $socket if defined $socket or $log_parser_started;
+
+	$log_parser_started = 1;
+	debug_msg("Starting log parser server");
+	system("python", "$ENV{TM_BUNDLE_SUPPORT}/bin/texparserd.py", "--daemon");
+	return IO::Socket::UNIX->new(Peer => log_parser_socket());
+}
+
 sub clear_html_output { #+
 	my ($cssid) = @_;
 	print  "<script id=\"clear\">clear_page(\"$cssid\");</script>";
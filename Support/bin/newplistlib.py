@@ -15,6 +15,12 @@ returns the top level object (again, usually a dictionary).
 To work with plist data in strings, you can use readPlistFromString()
 and writePlistToString().
 
+Binary plists ("bplist00", the format TextMate and most Apple programs
+write their preferences in) are read as well.  readBinaryPlist(path)
+maps the file into memory and by default decodes dictionary values only
+when they are looked up, so fetching a few keys from a large file does
+not decode the whole object graph.
+
 Values can be strings, integers, floats, booleans, tuples, lists,
 dictionaries, Data or datetime.datetime objects. String values (including
 dictionary keys) may be unicode strings -- they will be written out as
@@ -53,6 +59,7 @@ Parse Plist example:
 
 __all__ = [
     "readPlist", "writePlist", "readPlistFromString", "writePlistToString",
+    "readBinaryPlist",
     "readPlistFromResource", "writePlistToResource",
     "Plist", "Data", "Dict"
 ]
@@ -62,6 +69,7 @@ import binascii
 import datetime
 from cStringIO import StringIO
 import re
+import struct
 
 
 def readPlist(pathOrFile):
@@ -71,15 +79,32 @@ def readPlist(pathOrFile):
     """
     didOpen = 0
     if isinstance(pathOrFile, (str, unicode)):
-        pathOrFile = open(pathOrFile)
+        pathOrFile = open(pathOrFile, "rb")
         didOpen = 1
-    p = PlistParser()
-    rootObject = p.parse(pathOrFile)
+    header = pathOrFile.read(len(BINARY_HEADER))
+    if header == BINARY_HEADER:
+        rootObject = BinaryPlistParser(header + pathOrFile.read(), lazy=False).parse()
+    else:
+        p = PlistParser()
+        rootObject = p.parse(StringIO(header + pathOrFile.read()))
     if didOpen:
         pathOrFile.close()
     return rootObject
 
 
+def readBinaryPlist(path, lazy=True):
+    """Read a binary .plist file by mapping it into memory.  With 'lazy'
+    dictionaries decode their values only when they are accessed.
+    """
+    import mmap
+    f = open(path, "rb")
+    try:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    return BinaryPlistParser(buf, lazy).parse()
+
+
 def writePlist(rootObject, pathOrFile):
     """Write 'rootObject' to a .plist file. 'pathOrFile' may either be a
     file name or a (writable) file object.
@@ -472,3 +497,167 @@ class PlistParser:
         self.addObject(Data.fromBase64(self.getData()))
     def end_date(self):
         self.addObject(_dateFromString(self.getData()))
+
+
+BINARY_HEADER = "bplist00"
+_binaryEpoch = datetime.datetime(2001, 1, 1)
+
+class InvalidBinaryPlist(ValueError):
+    pass
+
+class BinaryPlistParser:
+
+    """Decode the objects of a bplist00 buffer (a string or an mmap).
+    The trailer gives the size of offsets and object references, the
+    number of objects, the top object and where the offset table is;
+    objects refer to each other by index into that table.
+    """
+
+    def __init__(self, buf, lazy=True):
+        self.buf = buf
+        self.lazy = lazy
+        self.objects = {}
+        if len(buf) < len(BINARY_HEADER) + 32 or buf[:len(BINARY_HEADER)] != BINARY_HEADER:
+            raise InvalidBinaryPlist("not a binary plist")
+        (self.offsetSize, self.refSize, self.numObjects, self.topObject,
+            self.tableOffset) = struct.unpack(">6xBBQQQ", buf[-32:])
+
+    def parse(self):
+        return self.getObject(self.topObject)
+
+    def readUInt(self, start, size):
+        data = self.buf[start:start + size]
+        if size == 1:
+            return ord(data)
+        elif size == 2:
+            return struct.unpack(">H", data)[0]
+        elif size == 4:
+            return struct.unpack(">L", data)[0]
+        elif size == 8:
+            return struct.unpack(">Q", data)[0]
+        value = 0
+        for c in data:
+            value = (value << 8) | ord(c)
+        return value
+
+    def readRefs(self, start, count):
+        size = self.refSize
+        return [self.readUInt(start + i * size, size) for i in range(count)]
+
+    def objectOffset(self, ref):
+        if ref >= self.numObjects:
+            raise InvalidBinaryPlist("object reference out of range")
+        return self.readUInt(self.tableOffset + ref * self.offsetSize, self.offsetSize)
+
+    def readCount(self, offset, info):
+        """Return the element count and the offset of the first element"""
+        if info != 0xF:
+            return info, offset + 1
+        marker = ord(self.buf[offset + 1])
+        size = 1 << (marker & 0xF)
+        return self.readUInt(offset + 2, size), offset + 2 + size
+
+    def getObject(self, ref):
+        if ref in self.objects:
+            return self.objects[ref]
+        value = self.decode(self.objectOffset(ref))
+        self.objects[ref] = value
+        return value
+
+    def decode(self, offset):
+        marker = ord(self.buf[offset])
+        kind, info = marker >> 4, marker & 0xF
+        if marker == 0x00:
+            return None
+        elif marker == 0x08:
+            return False
+        elif marker == 0x09:
+            return True
+        elif kind == 0x1:
+            size = 1 << info
+            value = self.readUInt(offset + 1, size)
+            if size >= 8 and value >= 1 << (size * 8 - 1):
+                value -= 1 << (size * 8)
+            return value
+        elif kind == 0x2:
+            if info == 2:
+                return struct.unpack(">f", self.buf[offset + 1:offset + 5])[0]
+            return struct.unpack(">d", self.buf[offset + 1:offset + 9])[0]
+        elif marker == 0x33:
+            seconds = struct.unpack(">d", self.buf[offset + 1:offset + 9])[0]
+            return _binaryEpoch + datetime.timedelta(seconds=seconds)
+        elif kind == 0x4:
+            count, start = self.readCount(offset, info)
+            return Data(self.buf[start:start + count])
+        elif kind == 0x5:
+            count, start = self.readCount(offset, info)
+            return self.buf[start:start + count]
+        elif kind == 0x6:
+            count, start = self.readCount(offset, info)
+            text = self.buf[start:start + 2 * count].decode("utf-16-be")
+            try:
+                text = text.encode("ascii")
+            except UnicodeError:
+                pass
+            return text
+        elif kind == 0x8:
+            return self.readUInt(offset + 1, info + 1)
+        elif kind in (0xA, 0xC):
+            count, start = self.readCount(offset, info)
+            return [self.getObject(r) for r in self.readRefs(start, count)]
+        elif kind == 0xD:
+            count, start = self.readCount(offset, info)
+            keyRefs = self.readRefs(start, count)
+            valueRefs = self.readRefs(start + count * self.refSize, count)
+            if self.lazy:
+                return _LazyDict(self, keyRefs, valueRefs)
+            d = _InternalDict()
+            for k, v in zip(keyRefs, valueRefs):
+                d[self.getObject(k)] = self.getObject(v)
+            return d
+        raise InvalidBinaryPlist("unknown object type 0x%02x" % marker)
+
+
+class _LazyDict(object):
+
+    """Read-only dictionary of a binary plist.  Keys are decoded up front,
+    values when they are first looked up."""
+
+    def __init__(self, parser, keyRefs, valueRefs):
+        self._parser = parser
+        self._refs = {}
+        self._keys = []
+        for k, v in zip(keyRefs, valueRefs):
+            key = parser.getObject(k)
+            self._refs[key] = v
+            self._keys.append(key)
+
+    def __getitem__(self, key):
+        return self._parser.getObject(self._refs[key])
+
+    def get(self, key, default=None):
+        if key in self._refs:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        return key in self._refs
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [self[k] for k in self._keys]
+
+    def items(self):
+        return [(k, self[k]) for k in self._keys]
+
+    def __repr__(self):
+        return "%s(%d keys)" % (self.__class__.__name__, len(self._keys))
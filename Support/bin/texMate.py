@@ -18,6 +18,12 @@
 #   expressions defined in the patterns dictionary.  If one of these patterns matches then the 
 #   corresponding method is called.  This method is also stored in the dictionary.  Pattern matching
 #   callback methods must each take the match object as well as the current line as a parameter.
+#   Callbacks do not print; they emit Events (see texevents.py) to a sink.  The default sink renders
+#   the HTML for the output window, JSON-lines and plain text renderers are also available.
+#
+#   Every phase of a run (and every program it starts) is timed by a PhaseTracer (textiming.py);
+#   for the commands that build, the times are shown in a hidden table and written to
+#   <file>.timing.json, which clean removes.
 #
 #   To enable debug mode without modifiying this file:
 #                 defaults write com.macromates.textmate latexDebug 1
@@ -34,16 +40,25 @@
 #   Future:
 # 
 #       think about replacing latexmk.pl with a simpler python version.  If only rubber worked reliably..
+#       run_texmk does this now, using the engine's -recorder file list.  latexmk.pl is still used
+#       for clean, and for typesetting when latexUselatexmkPl is set.
 #
 
 import sys
 import re
 from os.path import basename
 import os
+import time
 import tmprefs
 from urllib import quote
 from struct import *
 from texparser import *
+from texdeps import KpseResolver, DependencyGraph, BuildRecord
+from texengine import engineCapabilities
+from fmtcache import FormatCache
+from cachestore import CacheFile, hashFile, hashString
+from texevents import Event, EventBuffer, getDefaultSink, setDefaultSink
+from textiming import PhaseTracer
 
 DEBUG = False
 
@@ -74,72 +89,362 @@ texMateVersion = ' $Rev$ '
 TM_BUNDLE_SUPPORT = os.getenv("TM_BUNDLE_SUPPORT").replace(" ", "\\ ")
 TM_SUPPORT_PATH = os.getenv("TM_SUPPORT_PATH").replace(" ", "\\ ")
 
+tracer = PhaseTracer()
+engineCapabilities = tracer.traced()(engineCapabilities)
+
+kpseResolvers = {}
+
+def getResolver(program='pdflatex'):
+    """Return the KpseResolver for program, one per run"""
+    if program not in kpseResolvers:
+        kpseResolvers[program] = KpseResolver(program)
+    return kpseResolvers[program]
+
 def expandName(fn,program='pdflatex'):
     sys.stdout.flush()
-    runObj = Popen('kpsewhich -progname="%s" "%s"' % (program, fn),shell=True,stdout=PIPE)
-    res = runObj.stdout.read().strip()
-    return res
+    return getResolver(program).expand(fn)
 
+def cpuCount():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+def runParallel(jobs, workers=None):
+    """Call the functions in jobs from at most workers threads (one per cpu by
+       default) and yield their results in the order of jobs, each as soon as it
+       and the ones before it are done.  The jobs are expected to spend their time
+       waiting for a child process."""
+    import threading
+    results = [None] * len(jobs)
+    done = [threading.Event() for job in jobs]
+    pending = range(len(jobs))
+    lock = threading.Lock()
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                if not pending:
+                    return
+                i = pending.pop(0)
+            finally:
+                lock.release()
+            try:
+                results[i] = (jobs[i](), None)
+            except Exception:
+                results[i] = (None, sys.exc_info())
+            done[i].set()
+    for n in range(min(workers or cpuCount(), len(jobs))):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        t.start()
+    for i in range(len(jobs)):
+        done[i].wait()
+        value, exc = results[i]
+        if exc:
+            raise exc[0], exc[1], exc[2]
+        yield value
+
+def bibtexInputs(auxfile, seen=None):
+    """The \\citation, \\bibdata and \\bibstyle lines bibtex reads from auxfile and
+       the aux files it \\@inputs"""
+    if seen is None:
+        seen = {}
+    seen[auxfile] = True
+    lines = []
+    try:
+        for line in open(auxfile):
+            if line.startswith('\\citation') or line.startswith('\\bibdata') or line.startswith('\\bibstyle'):
+                lines.append(line)
+            elif line.startswith('\\@input{'):
+                sub = line[len('\\@input{'):line.find('}')]
+                if sub not in seen:
+                    lines += bibtexInputs(sub, seen)
+    except IOError:
+        pass
+    return lines
+
+def bibtexKey(auxfile):
+    """Hash of everything bibtex reads for auxfile: the citation lines and the
+       contents of the .bib and .bst files.  None if auxfile has no \\bibdata."""
+    lines = bibtexInputs(auxfile)
+    names = []
+    for line in lines:
+        m = re.match(r'\\bib(data|style)\{(.*)\}', line)
+        if m:
+            suffix = m.group(1) == 'data' and '.bib' or '.bst'
+            names += [n.strip() + suffix for n in m.group(2).split(',') if n.strip()]
+    if not [n for n in names if n.endswith('.bib')]:
+        return None
+    paths = getResolver('bibtex').resolve(names)
+    for name in names:
+        lines.append('%s %s\n' % (name, paths[name] and hashFile(paths[name])))
+    return hashString(''.join(lines))
+
+@tracer.traced()
+def bibtexJob(auxfile,verbose=False):
+    """Run bibtex on auxfile, keeping its messages in an EventBuffer"""
+    buf = EventBuffer()
+    runObj = Popen('bibtex'+" "+shell_quote(auxfile),shell=True,stdout=PIPE,stdin=PIPE,stderr=STDOUT,close_fds=True)
+    bp = BibTexParser(runObj.stdout,verbose,buf)
+    f,e,w = bp.parseStream()
+    stat = runObj.wait()
+    return buf,stat,f,e,w
+
+@tracer.traced()
 def run_bibtex(bibfile=None,verbose=False,texfile=None):
-    """Determine Targets and run bibtex"""
+    """Determine Targets and run bibtex.  An aux file is skipped when its citations
+       and the .bib and .bst files are the same as for the last successful run and
+       the .bbl is still there.  The others (bibunits and multibib documents have
+       several) are run in parallel, their messages are shown in the order of the
+       aux files."""
     # find all the aux files.
     fatal,err,warn = 0,0,0
+    stat = 0
     auxfiles = []
     if texfile:
         basename = texfile[:texfile.rfind('.')]
     if bibfile == None:
         auxfiles = [f for f in os.listdir('.') if re.search('.aux$',f) > 0]
         auxfiles = [f for f in auxfiles if re.match(r'('+ basename +r'\.aux|bu\d+\.aux)',f)]
+        auxfiles.sort(key=lambda f: (f != basename+'.aux', int(re.sub(r'\D','',f) or 0)))
     else:
         auxfiles = [bibfile]
+    sink = getDefaultSink()
+    cache = CacheFile('bibtex')
+    entries = cache.load()
+    targets = []
+    jobs = []
     for bib in auxfiles:
-        print '<h4>Processing: %s </h4>' % bib
-        runObj = Popen('bibtex'+" "+shell_quote(bib),shell=True,stdout=PIPE,stdin=PIPE,stderr=STDOUT,close_fds=True)
-        bp = BibTexParser(runObj.stdout,verbose)
-        f,e,w = bp.parseStream()
+        key = bibtexKey(bib)
+        if key and entries.get(os.path.abspath(bib)) == key and os.path.exists(bib[:bib.rfind('.')]+'.bbl'):
+            targets.append((bib,key,False))
+        else:
+            targets.append((bib,key,True))
+            jobs.append(lambda bib=bib: bibtexJob(bib,verbose))
+    results = runParallel(jobs)
+    for bib,key,run in targets:
+        sink.emit(Event('file', None, file=bib))
+        if not run:
+            sink.emit(Event('cached', 'bibtex skipped, citations and databases are unchanged', file=bib))
+            sink.flush()
+            continue
+        buf,stat,f,e,w = results.next()
+        buf.replay(sink)
         fatal|=f
         err+=e
         warn+=w
-        stat = runObj.wait()
+        entry = os.path.abspath(bib)
+        if key and not f and not e:
+            entries[entry] = key
+        elif entry in entries:
+            del entries[entry]
+    cache.save(entries)
     return stat,fatal,err,warn
         
+@tracer.traced()
 def run_latex(ltxcmd,texfile,verbose=False):
     """Run the flavor of latex specified by ltxcmd on texfile"""
-    global numRuns
+    global numRuns, rerunRequested
     if DEBUG:
         print "<pre>in run_latex: ", ltxcmd+" "+shell_quote(texfile), "</pre>"
     runObj = Popen(ltxcmd+" "+shell_quote(texfile),shell=True,stdout=PIPE,stdin=PIPE,stderr=STDOUT,close_fds=True)
     lp = LaTexParser(runObj.stdout,verbose,texfile)
+    lp.run = numRuns + 1
     f,e,w = lp.parseStream()
     stat = runObj.wait()
     numRuns += 1
+    rerunRequested = lp.rerunRequested
     return stat,f,e,w
 
+@tracer.traced()
+def makeindexJob(idxFile):
+    """Run makeindex on idxFile, keeping its messages in an EventBuffer"""
+    buf = EventBuffer()
+    start = time.time()
+    runObj = Popen('makeindex '+shell_quote(idxFile),shell=True,stdout=PIPE,stdin=PIPE,stderr=STDOUT,close_fds=True)
+    ip = TexParser(runObj.stdout,True,buf)
+    f,e,w = ip.parseStream()
+    stat = runObj.wait()
+    return buf,stat,f,e,w,time.time()-start
+
+@tracer.traced()
 def run_makeindex(fileName,idxfile=None):
-    ## TODO foreach \makeindex[(.*)] run makeindex on $1, plus the master file.
-    """Run the makeindex command"""
+    """Run the makeindex command on the master's .idx file and on one for each
+       \\makeindex[name] in the preamble.  Index files whose contents did not change
+       since the last successful run are skipped if their .ind exists, the others
+       are run in parallel."""
     try:
-        texString = open(fileName).read()
+        texFile = open(fileName)
     except:
         print '<p class="error">Error: Could not open %s to check for makeindex</p>' % fileName
         print '<p class="error">This is most likely a problem with TM_LATEX_MASTER</p>'
         sys.exit(1)
-    myList = [x[2] for x in re.findall(r'([^%]|^)\\makeindex(\[([\w]+)\])?',texString) if x[2] ]
+    myList = []
+    for line in texFile:
+        if '\\begin{document}' in line.split('%')[0]:
+            break
+        myList += [x[2]+'.idx' for x in re.findall(r'([^%]|^)\\makeindex(\[([\w]+)\])?',line) if x[2] ]
+    texFile.close()
     
     fileNoSuffix = getFileNameWithoutExtension(fileName)
     idxFile = fileNoSuffix+'.idx'
     myList.append(idxFile)
     fatal, error, warning = 0,0,0
+    stat = 0
+    sink = getDefaultSink()
+    cache = CacheFile('makeindex')
+    entries = cache.load()
+    targets = []
+    jobs = []
     for idxFile in myList:
-        runObj = Popen('makeindex '+idxFile,shell=True,stdout=PIPE,stdin=PIPE,stderr=STDOUT,close_fds=True)        
-        ip = TexParser(runObj.stdout,True)
-        f,e,w = ip.parseStream()
+        digest = hashFile(idxFile)
+        run = not (digest and entries.get(os.path.abspath(idxFile)) == digest and os.path.exists(idxFile[:-4]+'.ind'))
+        targets.append((idxFile,digest,run))
+        if run:
+            jobs.append(lambda idxFile=idxFile: makeindexJob(idxFile))
+    results = runParallel(jobs)
+    for idxFile,digest,run in targets:
+        sink.emit(Event('file', None, file=idxFile))
+        if not run:
+            sink.emit(Event('cached', 'makeindex skipped, the index entries are unchanged', file=idxFile))
+            sink.flush()
+            continue
+        buf,stat,f,e,w,elapsed = results.next()
+        buf.replay(sink)
+        sink.emit(Event('info', 'makeindex %s: exit status %d, %d errors, %d warnings, %.2f s' % (idxFile, stat, e, w, elapsed)))
+        sink.flush()
         fatal |= f
         error += e
         warning += w
-        stat = runObj.wait()
+        entry = os.path.abspath(idxFile)
+        if digest and stat == 0 and not f and not e:
+            entries[entry] = digest
+        elif entry in entries:
+            del entries[entry]
+    cache.save(entries)
     return stat,fatal,error,warning
 
+def citationKey(fileNoSuffix):
+    """Hash of the \\citation, \\bibdata and \\bibstyle lines of the aux files, None if
+       the document has no bibliography"""
+    lines = []
+    auxfiles = [fileNoSuffix+'.aux'] + sorted([f for f in os.listdir('.') if re.match(r'bu\d+\.aux$',f)])
+    for aux in auxfiles:
+        try:
+            for line in open(aux):
+                if line.startswith('\\citation') or line.startswith('\\bibdata') or line.startswith('\\bibstyle'):
+                    lines.append(line)
+        except IOError:
+            pass
+    if not [l for l in lines if l.startswith('\\bibdata')]:
+        return None
+    return hashString(''.join(lines))
+
+def outputHashes(fileNoSuffix, suffixes):
+    """Map each suffix to the content hash of fileNoSuffix.suffix (None if missing)"""
+    return dict([(suffix, hashFile(fileNoSuffix+'.'+suffix)) for suffix in suffixes])
+
+@tracer.traced()
+def run_builtin(texCommand,fileName,verbose=False,maxPasses=5):
+    """Run latex until its auxiliary files stop changing.  After the first pass
+       run_bibtex is always called, since a .bib file may have changed; after later
+       passes only if the citations changed or there is no .bbl yet.  makeindex
+       runs if the .idx changed, and another pass follows if LaTeX asked for a
+       rerun, or the .aux/.toc/.lof/.lot or the .bbl/.ind inputs changed.
+       At most maxPasses latex passes are made."""
+    fileNoSuffix = getFileNameWithoutExtension(fileName)
+    auxSuffixes = ['aux','toc','lof','lot','out']
+    before = outputHashes(fileNoSuffix, auxSuffixes + ['idx','bbl','ind'])
+    citations = None        # run_bibtex decides itself whether the first pass needs bibtex
+    passes = 0
+    while True:
+        texStatus,isFatal,numErrs,numWarns = run_latex(texCommand,fileName,verbose)
+        passes += 1
+        if isFatal:
+            break
+        after = outputHashes(fileNoSuffix, auxSuffixes + ['idx'])
+        rerun = rerunRequested or [s for s in auxSuffixes if before[s] != after[s]] != []
+        newCitations = citationKey(fileNoSuffix)
+        if newCitations and (newCitations != citations or not os.path.exists(fileNoSuffix+'.bbl')):
+            run_bibtex(texfile=fileName)
+        citations = newCitations
+        if after['idx'] and (after['idx'] != before['idx'] or not os.path.exists(fileNoSuffix+'.ind')):
+            run_makeindex(fileName)
+        after.update(outputHashes(fileNoSuffix, ['bbl','ind']))
+        if after['bbl'] != before['bbl'] or after['ind'] != before['ind']:
+            rerun = True
+        before = after
+        if not rerun:
+            break
+        if passes >= maxPasses:
+            print '<p class="warning">Warning: stopped after %d passes, the auxiliary files are still changing</p>' % passes
+            break
+    return texStatus,isFatal,numErrs,numWarns
+
+@tracer.traced()
+def run_texmk(engine,engineOptions,fileName,verbose=False,maxPasses=5):
+    """Typeset fileName the way latexmk would, without latexmk.pl.  The engine runs
+       with -recorder; if none of the files it read last time, nor the bibliography
+       inputs, changed and the outputs are still there nothing is run at all.
+       Otherwise run_builtin makes as many passes as needed."""
+    fileNoSuffix = getFileNameWithoutExtension(fileName)
+    texCommand = engine + " -recorder " + engineOptions
+    auxfiles = [fileNoSuffix+'.aux'] + sorted([f for f in os.listdir('.') if re.match(r'bu\d+\.aux$',f)])
+    bibKey = ' '.join([bibtexKey(aux) or '-' for aux in auxfiles])
+    record = BuildRecord(fileName, texCommand)
+    if os.path.exists(fileNoSuffix+'.pdf') and record.upToDate(bibKey):
+        sink = getDefaultSink()
+        sink.emit(Event('cached', 'all files are up to date', file=fileName))
+        sink.flush()
+        return 0,False,0,0
+    texStatus,isFatal,numErrs,numWarns = run_builtin(texCommand,fileName,verbose,maxPasses)
+    if engine == 'latex' and not isFatal:
+        psFile = fileNoSuffix+'.ps'
+        os.system('dvips ' + shell_quote(fileNoSuffix+'.dvi') + ' -o ' + shell_quote(psFile))
+        os.system('ps2pdf ' + shell_quote(psFile))
+    if isFatal or numErrs:
+        record.forget()
+    else:
+        bibKey = ' '.join([bibtexKey(aux) or '-' for aux in auxfiles])
+        record.record(fileNoSuffix+'.fls', bibKey)
+    return texStatus,isFatal,numErrs,numWarns
+
+@tracer.traced()
+def cachedFormat(engine,fileName):
+    """Return the name of a format with the preamble of fileName already loaded,
+       for use with -fmt.  Formats come from the shared format cache; a missing one
+       is built with mylatexformat and added to it.  None if the engine has no
+       LaTeX format to start from or building the format fails."""
+    if engine not in ('pdflatex','xelatex','latex'):
+        return None
+    preamble = []
+    for line in open(fileName):
+        preamble.append(line)
+        if re.match(r'[^%]*\\begin\{document\}', line):
+            break
+    else:
+        return None
+    builder = '%s &%s mylatexformat.ltx' % (engine, engine)
+    cache = FormatCache()
+    key = cache.key(''.join(preamble), builder)
+    if key is None:
+        return None
+    found = cache.lookup(key)
+    if found:
+        return found[0][:-4]
+    job = '.' + getFileNameWithoutExtension(fileName) + '-preamble'
+    print '<p class="info">Building a format for the preamble of %s</p>' % fileName
+    stat = os.system('%s -ini -interaction=batchmode -recorder -jobname=%s "&%s" mylatexformat.ltx %s >/dev/null' % (engine, shell_quote(job), engine, shell_quote(fileName)))
+    fmtFile = None
+    if stat == 0 and os.path.exists(job+'.fmt'):
+        fmtFile = cache.store(key, job+'.fmt', job+'.fls', fileName)
+    for suffix in ('fmt','fls','log'):
+        if os.path.exists(job+'.'+suffix):
+            os.remove(job+'.'+suffix)
+    return fmtFile and fmtFile[:-4]
+
 def findViewerPath(viewer,pdfFile,fileName):
     """Use the find_app command to ensure that the viewer is installed in the system
        For apps that support pdfsync search in pdf set up the command to go to the part of
@@ -169,6 +474,7 @@ def refreshViewer(viewer,pdfPath):
         os.system("/usr/bin/osascript -e " + """'tell application "TeXShop" to tell documents whose path is %s to refreshpdf' """%pdfPath)
 
 # TODO refactor run_viewer and sync_viewer to work together better
+@tracer.traced()
 def sync_viewer(viewer,fileName,filePath):
     fileNoSuffix = getFileNameWithoutExtension(fileName)
     pdfFile = shell_quote(fileNoSuffix+'.pdf')
@@ -179,6 +485,7 @@ def sync_viewer(viewer,fileName,filePath):
         print 'pdfsync is not supported for this viewer'
     return stat
     
+@tracer.traced()
 def run_viewer(viewer,fileName,filePath,force,usePdfSync=True):
     """If the viewer is textmate, then setup the proper urls and/or redirects to show the
        pdf file in the html output window.
@@ -215,6 +522,7 @@ def run_viewer(viewer,fileName,filePath,force,usePdfSync=True):
             print '</script>'
     return stat
 
+@tracer.traced()
 def determine_ts_directory(tsDirectives):
     """Determine the proper directory to use for typesetting the current document"""
     master = os.getenv('TM_LATEX_MASTER')
@@ -234,66 +542,27 @@ def determine_ts_directory(tsDirectives):
         print '<pre>Typesetting Directory = ', masterPath, '</pre>'
     return masterPath
 
+@tracer.traced()
 def findTexPackages(fileName):
     """Find all packages included by the master file.
-       or any file included from the master.  We should not have to go
-       more than one level deep for preamble stuff.
+       or any file included from the master, following includes as deep
+       as they go.  The scan results are cached per file in a DependencyGraph,
+       so an unchanged preamble is not read again.
     """
+    realfn = expandName(fileName)
     try:
-        realfn = expandName(fileName)
-        texString = open(realfn)
-    except:
-        print '<p class="error">Error: Could not open %s to check for packages</p>' % realfn
+        newList, unreadable = DependencyGraph(realfn, getResolver()).packages()
+    except (IOError, OSError):
+        print '<p class="error">Error: Could not open %s to check for packages</p>' % (realfn or fileName)
         print '<p class="error">This is most likely a problem with TM_LATEX_MASTER</p>'
         sys.exit(1)
-
-        
-    inputre = re.compile(r'((^|\n)[^%]*?)(\\input|\\include)\{([\w /\.\-]+)\}')
-    usepkgre = re.compile(r'((^|\n)[^%]*?)\\usepackage(\[[\w, \-]+\])?\{([\w,\-]+)\}')
-                         #r'((^|\n)[^%]*?)\\usepackage(\[[\w, \-]+\])?\{([\w,\-]+)\}'
-    beginre = re.compile(r'((^|\n)[^%]*?)\\begin\{document\}')
-    incFiles = []
-    myList = []
-    for line in texString:
-        begin = re.search(beginre,line)
-        inc = re.search(inputre,line)
-        usepkg = re.search(usepkgre,line)
-        if begin:
-            break
-        elif inc:
-            incFiles.append(inc.group(4))
-        elif usepkg:
-            myList.append(usepkg.group(4))
-    #incFiles = [x[3] for x in re.findall(inputre,texString)]
-    #myList = [x[3] for x in re.findall(usepkgre,texString)]
-    beginFound = False
-    for ifile in incFiles:
-        if ifile.find('.tex') < 0:
-            ifile += '.tex'
-        try:
-            realif = expandName(ifile)
-            incmatches = []
-            for line in file(realif):
-                incmatches.append(re.search(usepkgre,line))
-                if re.search(beginre,line):
-                    beginFound = True
-#            incmatches = [re.search(usepkgre,line) for line in file(realif)] 
-            myList += [x.group(4) for x in incmatches if x]
-        except:
-            print '<p class="warning">Warning: Could not open %s to check for packages</p>' % ifile
-        if beginFound:
-            break
-    newList = []
-    for pkg in myList:
-        if pkg.find(',') >= 0:
-            for sp in pkg.split(','):
-                newList.append(sp.strip())
-        else:
-            newList.append(pkg.strip())
+    for ifile in unreadable:
+        print '<p class="warning">Warning: Could not open %s to check for packages</p>' % ifile
     if DEBUG:
         print '<pre>TEX package list = ', newList, '</pre>'
     return newList
 
+@tracer.traced()
 def find_TEX_directives():
     """build a dictionary of %!TEX directives
        the main ones we are concerned with are
@@ -339,6 +608,7 @@ def find_TEX_directives():
         print '<pre>%!TEX Directives: ', tsDirectives, '</pre>'
     return tsDirectives
 
+@tracer.traced()
 def findFileToTypeset(tsDirectives):
     """determine which file to typeset.  Using the following rules:
        + %!TEX root directive
@@ -382,6 +652,7 @@ def usesOnePackage(testPack, allPackages):
             return True
     return False
 
+@tracer.traced()
 def constructEngineCommand(tsDirectives,tmPrefs,packages):
     """This function decides which engine to run using 
        + %!TEX directives from the tex file
@@ -406,8 +677,7 @@ def constructEngineCommand(tsDirectives,tmPrefs,packages):
         engine = 'xelatex'
     else:
         engine = tmPrefs['latexEngine']
-    stat = os.system('type '+engine+' > /dev/null')
-    if stat != 0:
+    if not engineCapabilities(engine):
         print '<p class="error">Error: %s is not found, you need to install LaTeX or be sure that your PATH is setup properly.</p>' % engine
         sys.exit(1)
     return engine
@@ -441,6 +711,7 @@ def writeLatexmkRc(engine,eOpts):
 if __name__ == '__main__':
     verbose = False
     numRuns = 0
+    rerunRequested = False
     stat = 0
     texStatus = None
     numErrs = 0
@@ -467,6 +738,9 @@ if __name__ == '__main__':
     if int(tmPrefs['latexDebug']) == 1:
         DEBUG = True
         print '<pre>turning on debug</pre>'
+        os.environ['TM_LATEX_PROFILE'] = '1'     # the parsers report what their patterns cost
+
+    setDefaultSink(budgeted(getDefaultSink(), tmPrefs))
 
     tsDirs = find_TEX_directives()
     os.chdir(determine_ts_directory(tsDirs))
@@ -493,9 +767,7 @@ if __name__ == '__main__':
     viewer = tmPrefs['latexViewer']
     engine = constructEngineCommand(tsDirs,tmPrefs,ltxPackages)
 
-    syncTexCheck = os.system(engine + " --help |grep -q synctex")
-    if syncTexCheck == 0:
-        synctex = True
+    synctex = engineCapabilities(engine)['synctex']
     
     # Make sure that the bundle_support/tex directory is added
     #pcmd = os.popen("kpsewhich -progname %s --expand-var '$TEXINPUTS':%s/tex//" % (engine,bundle_support))
@@ -522,8 +794,7 @@ if __name__ == '__main__':
 
 
     if texCommand == "version":
-      runObj = Popen(engine + " --version",stdout=PIPE,shell=True)
-      print runObj.stdout.read().split("\n")[0]
+      print engineCapabilities(engine)['version']
       sys.exit(0)
 
 
@@ -545,7 +816,13 @@ if __name__ == '__main__':
 #
 # Run the command passed on the command line or modified by preferences
 #
-    if texCommand == 'latexmk':
+    building = texCommand in ('latexmk', 'builtin', 'latex', 'bibtex', 'index')   # timed commands
+    if texCommand == 'latexmk' and not tmPrefs['latexUselatexmkPl']:
+        texStatus,isFatal,numErrs,numWarns = run_texmk(engine,constructEngineOptions(tsDirs,tmPrefs),fileName,verbose,int(tmPrefs['latexMaxPasses']))
+        if tmPrefs['latexAutoView'] and numErrs < 1:
+            stat = run_viewer(viewer,fileName,filePath,tmPrefs['latexKeepLogWin'],'pdfsync' in ltxPackages or synctex)
+
+    elif texCommand == 'latexmk':
         writeLatexmkRc(engine,constructEngineOptions(tsDirs,tmPrefs))
         if engine == 'latex':
             texCommand = TM_BUNDLE_SUPPORT + '/bin/latexmk.pl -pdfps -f -r /tmp/latexmkrc ' 
@@ -573,22 +850,25 @@ if __name__ == '__main__':
         texStatus, isFatal, numErrs, numWarns = run_makeindex(fileName)
     
     elif texCommand == 'clean':
+        if os.path.exists(fileNoSuffix+'.timing.json'):
+            os.remove(fileNoSuffix+'.timing.json')
         texCommand = 'latexmk.pl -CA '
         runObj = Popen(texCommand,shell=True,stdout=PIPE,stdin=PIPE,stderr=STDOUT,close_fds=True)
         commandParser = ParseLatexMk(runObj.stdout,True,fileName)
         
     elif texCommand == 'builtin':
-        # the latex, bibtex, index, latex, latex sequence should cover 80% of the cases that latexmk does
+        # latex, then bibtex, makeindex and more latex passes only as long as they change something
         texCommand =  engine + " " + constructEngineOptions(tsDirs,tmPrefs)
-        texStatus,isFatal,numErrs,numWarns = run_latex(texCommand,fileName,verbose)
-        texStatus, isFatal, numErrs, numWarns = run_bibtex(texfile=fileName)
-        if os.path.exists(fileNoSuffix+'.idx'):
-            texStatus, isFatal, numErrs, numWarns = run_makeindex(fileName)
-        texStatus,isFatal,numErrs,numWarns = run_latex(texCommand,fileName,verbose)
-        texStatus,isFatal,numErrs,numWarns = run_latex(texCommand,fileName,verbose)
+        preambleFormat = tmPrefs['latexFormatCache'] and cachedFormat(engine,fileName)
+        if preambleFormat:
+            texCommand += ' -fmt=' + shell_quote(preambleFormat)
+        texStatus,isFatal,numErrs,numWarns = run_builtin(texCommand,fileName,verbose,int(tmPrefs['latexMaxPasses']))
         
     elif texCommand =='latex':
         texCommand = engine + " " + constructEngineOptions(tsDirs,tmPrefs)
+        preambleFormat = tmPrefs['latexFormatCache'] and cachedFormat(engine,fileName)
+        if preambleFormat:
+            texCommand += ' -fmt=' + shell_quote(preambleFormat)
         texStatus,isFatal,numErrs,numWarns = run_latex(texCommand,fileName,verbose)  # Hack: Eigentlich True = verbose, aber es funktionierte nicht über die Einstellugen im Latex-Bundle
         if engine == 'latex':
             psFile = fileNoSuffix+'.ps'
@@ -665,6 +945,9 @@ if __name__ == '__main__':
     else:
         eCode = 0
 
+    if building:
+        print tracer.html()
+        tracer.save(fileNoSuffix+'.timing.json')
     print '</div></div>'  # closes <pre> and <div id="commandOutput"> 
 
 #
@@ -692,6 +975,11 @@ if __name__ == '__main__':
         print '<p>'
         print '<input type="checkbox" id="hv_warn" name="fmtWarnings" onclick="makeFmtWarnVisible(); return false" />'
         print '<label for="hv_warn">Show hbox,vbox Warnings </label>'     
+        print '<input type="checkbox" id="warn_lines" name="warningLines" onclick="makeWarningLinesVisible(); return false" />'
+        print '<label for="warn_lines">Show Lines of Repeated Warnings </label>'
+        if building:
+            print '<input type="checkbox" id="timing" name="timing" onclick="makeTimingVisible(); return false" />'
+            print '<label for="timing">Show Timing </label>'
         if useLatexMk:
             print '<input type="checkbox" id="ltxmk_warn" name="ltxmkWarnings" onclick="makeLatexmkVisible(); return false" />'
             print '<label for="ltxmk_warn">Show Latexmk.pl Messages </label>'
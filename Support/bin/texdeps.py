@@ -0,0 +1,273 @@
+import os
+import re
+from cachestore import CacheFile, fileSignature, hashFile, hashString
+
+try:
+    from subprocess import Popen, PIPE
+except ImportError:
+    Popen = None
+
+
+class KpseResolver(object):
+    """Find TeX input files the way TeX does, using kpsewhich.
+       All names that are not already known are looked up with a single kpsewhich
+       call.  Answers are remembered on disk, keyed by name, program, TEXINPUTS and
+       the current directory, and are thrown away when the modification time of the
+       file found changes or the file disappears."""
+    def __init__(self, program='pdflatex', texinputs=None):
+        super(KpseResolver, self).__init__()
+        self.program = program
+        if texinputs is None:
+            texinputs = os.getenv('TEXINPUTS') or ''
+        self.texinputs = texinputs
+        self.cache = CacheFile('kpsewhich')
+        self.entries = None
+
+    def key(self, name):
+        return '\0'.join((name, self.program, self.texinputs, os.getcwd()))
+
+    def lookup(self, name):
+        """Return the cached path for name if it is still valid"""
+        entry = self.entries.get(self.key(name))
+        if entry:
+            path, mtime = entry
+            sig = fileSignature(path)
+            if sig and sig[0] == mtime:
+                return path
+            del self.entries[self.key(name)]
+        return None
+
+    def matches(self, name, path):
+        """Whether path can be kpsewhich's answer for name: it is name, or name.tex,
+           as a whole path component"""
+        bare = name
+        if bare.startswith('./'):
+            bare = bare[2:]
+        for candidate in (bare, bare + '.tex'):
+            if path == candidate or path.endswith('/' + candidate):
+                return True
+        return False
+
+    def run(self, names):
+        """The paths kpsewhich prints for names"""
+        runObj = Popen(['kpsewhich', '-progname=%s' % self.program] + names, stdout=PIPE)
+        found = [l.strip() for l in runObj.stdout.read().split('\n') if l.strip()]
+        runObj.wait()
+        return found
+
+    def kpsewhich(self, names):
+        """Run kpsewhich once for all names.  It only prints the files it found, in
+           the order they were asked for, so pair each output line with the next name
+           it can belong to.  Names whose line could belong to another name too are
+           looked up one at a time, and so are the names left without a line if some
+           lines could not be paired."""
+        found = self.run(names)
+        unsure = [name for name in names
+                  if [l for l in found if self.matches(name, l)
+                      and [o for o in names if o != name and self.matches(o, l)]]]
+        lines = [l for l in found if not [u for u in unsure if self.matches(u, l)]]
+        result = {}
+        missing = []
+        i = 0
+        for name in names:
+            if name in unsure:
+                continue
+            if i < len(lines) and self.matches(name, lines[i]):
+                result[name] = lines[i]
+                i += 1
+            else:
+                missing.append(name)
+        if i < len(lines):
+            unsure += missing
+        for name in unsure:
+            single = self.run([name])
+            if single:
+                result[name] = single[0]
+        return result
+
+    def resolve(self, names):
+        """Return a dictionary mapping each of names to its path, '' if not found"""
+        if self.entries is None:
+            self.entries = self.cache.load()
+        result = {}
+        missing = []
+        for name in names:
+            path = self.lookup(name)
+            if path:
+                result[name] = path
+            elif name not in missing:
+                missing.append(name)
+        if missing:
+            found = self.kpsewhich(missing)
+            for name in missing:
+                path = found.get(name, '')
+                result[name] = path
+                sig = fileSignature(path)
+                if path and sig:
+                    self.entries[self.key(name)] = (path, sig[0])
+            self.cache.save(self.entries)
+        return result
+
+    def expand(self, name):
+        """Resolve a single name"""
+        return self.resolve([name])[name]
+
+
+class DependencyGraph(object):
+    """The files a document's preamble reads, and the packages they load.
+       Every file is scanned for \\input, \\include and \\usepackage up to
+       \\begin{document}, and includes are followed recursively.  The result for
+       each file is kept in a per project cache together with its mtime, size and
+       content hash, so only files that changed are read again."""
+    inputre = re.compile(r'((^|\n)[^%]*?)(\\input|\\include)\{([\w /\.\-]+)\}')
+    usepkgre = re.compile(r'((^|\n)[^%]*?)\\usepackage(\[[\w, \-]+\])?\{([\w,\-]+)\}')
+    beginre = re.compile(r'((^|\n)[^%]*?)\\begin\{document\}')
+
+    def __init__(self, master, resolver):
+        super(DependencyGraph, self).__init__()
+        self.master = os.path.abspath(master)
+        self.resolver = resolver
+        self.cache = CacheFile('deps-' + hashString(self.master))
+        self.nodes = None
+        self.changed = False
+
+    def scanFile(self, path):
+        """Return the includes and packages found in the preamble part of path"""
+        includes = []
+        packages = []
+        begin = False
+        for line in open(path):
+            if self.beginre.search(line):
+                begin = True
+                break
+            inc = self.inputre.search(line)
+            if inc:
+                includes.append(inc.group(4))
+                continue
+            usepkg = self.usepkgre.search(line)
+            if usepkg:
+                packages += [p.strip() for p in usepkg.group(4).split(',')]
+        return {'includes' : includes, 'packages' : packages, 'begin' : begin}
+
+    def node(self, path):
+        """Return the scan result for path, reading the file only if it changed"""
+        sig = fileSignature(path)
+        if sig is None:
+            raise IOError('cannot stat %s' % path)
+        node = self.nodes.get(path)
+        if node and node['sig'] == sig:
+            return node
+        digest = hashFile(path)
+        if not node or node['hash'] != digest:
+            node = self.scanFile(path)
+            node['hash'] = digest
+        node['sig'] = sig
+        self.nodes[path] = node
+        self.changed = True
+        return node
+
+    def packages(self):
+        """Return the packages used by the preamble, and the include files that
+           could not be read.  The walk stops after the file that contains
+           \\begin{document}."""
+        if self.nodes is None:
+            self.nodes = self.cache.load()
+        packages = []
+        unreadable = []
+        visited = {}
+        def visit(path):
+            visited[path] = True
+            node = self.node(path)
+            packages.extend(node['packages'])
+            names = [n.find('.tex') < 0 and n + '.tex' or n for n in node['includes']]
+            paths = self.resolver.resolve(names)
+            for name in names:
+                incPath = paths[name] and os.path.abspath(paths[name])
+                if not incPath:
+                    unreadable.append(name)
+                    continue
+                if incPath in visited:
+                    continue
+                try:
+                    if visit(incPath):
+                        return True
+                except (IOError, OSError):
+                    unreadable.append(name)
+            return node['begin']
+        visit(self.master)
+        if self.changed:
+            self.cache.save(self.nodes)
+            self.changed = False
+        return packages, unreadable
+
+
+def readRecorderFile(flsFile):
+    """Return the absolute paths of the files read and the files written according
+       to the file list an engine writes when run with -recorder"""
+    inputs = []
+    outputs = []
+    seen = {}
+    cwd = os.getcwd()
+    for line in open(flsFile):
+        line = line.rstrip('\n')
+        if line.startswith('PWD '):
+            cwd = line[4:]
+            continue
+        kind, sep, path = line.partition(' ')
+        if kind not in ('INPUT', 'OUTPUT'):
+            continue
+        path = os.path.normpath(os.path.join(cwd, path))
+        if (kind, path) in seen:
+            continue
+        seen[(kind, path)] = True
+        if kind == 'INPUT':
+            inputs.append(path)
+        else:
+            outputs.append(path)
+    return inputs, outputs
+
+
+class BuildRecord(object):
+    """The inputs of the last successful build of a document.
+       The files come from the engine's -recorder list.  Files the engine wrote
+       itself (.aux, .toc, ...) are left out, they are the business of the rerun
+       logic.  Every input is stored with its mtime, size and content hash; a
+       document is up to date when the command and the extra key (bibliography
+       inputs, which the recorder does not see) are the same, all outputs still
+       exist and no input changed its contents."""
+    def __init__(self, master, command):
+        super(BuildRecord, self).__init__()
+        self.cache = CacheFile('build-' + hashString(os.path.abspath(master)))
+        self.command = command
+
+    def upToDate(self, extra=None):
+        data = self.cache.load()
+        if not data or data['command'] != self.command or data['extra'] != extra:
+            return False
+        for path in data['outputs']:
+            if not os.path.exists(path):
+                return False
+        for path, (sig, digest) in data['inputs'].items():
+            if fileSignature(path) != sig and hashFile(path) != digest:
+                return False
+        return True
+
+    def record(self, flsFile, extra=None):
+        """Remember the inputs listed in flsFile"""
+        try:
+            inputs, outputs = readRecorderFile(flsFile)
+        except IOError:
+            self.forget()
+            return
+        written = dict([(p, True) for p in outputs])
+        state = {}
+        for path in inputs:
+            sig = fileSignature(path)
+            if path in written or sig is None:
+                continue
+            state[path] = (sig, hashFile(path))
+        self.cache.save({'command' : self.command, 'extra' : extra,
+                         'inputs' : state, 'outputs' : outputs})
+
+    def forget(self):
+        self.cache.save({})
@@ -0,0 +1,67 @@
+import os
+from cachestore import CacheFile, fileSignature
+
+try:
+    from subprocess import Popen, PIPE, STDOUT
+except ImportError:
+    Popen = None
+
+# What a TeX engine can do, found out once per binary.
+#
+# texMate.py used to run "type engine" and "engine --help | grep synctex" on every build, which
+# starts a complete TeX binary only to read its help text.  The answers are now cached by the
+# path of the engine and refreshed when the binary behind it changes.
+
+def findExecutable(name):
+    """Return the full path of the program name searched on PATH, or None"""
+    if os.sep in name:
+        if os.access(name, os.X_OK):
+            return name
+        return None
+    for directory in (os.getenv('PATH') or '').split(os.pathsep):
+        path = os.path.join(directory or '.', name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+def programOutput(args):
+    """stdout and stderr of running args, '' if it cannot be run"""
+    try:
+        runObj = Popen(args, stdout=PIPE, stderr=STDOUT, stdin=PIPE, close_fds=True)
+        runObj.stdin.close()
+        output = runObj.stdout.read()
+        runObj.wait()
+    except OSError:
+        return ''
+    return output
+
+_capabilities = {}
+
+def engineCapabilities(engine):
+    """Return a dictionary describing engine, or None if it is not installed:
+          path       full path of the program
+          version    first line of engine --version
+          synctex    True if the engine understands -synctex
+          draftmode  True if the engine understands -draftmode"""
+    if engine in _capabilities:
+        return _capabilities[engine]
+    caps = None
+    path = findExecutable(engine.split()[0])
+    if path:
+        signature = fileSignature(os.path.realpath(path))
+        cache = CacheFile('engines')
+        entries = cache.load()
+        caps = entries.get(path)
+        if not caps or caps['signature'] != signature:
+            helpText = programOutput([path, '--help'])
+            caps = {
+                'path' : path,
+                'signature' : signature,
+                'version' : programOutput([path, '--version']).split('\n')[0],
+                'synctex' : 'synctex' in helpText,
+                'draftmode' : 'draftmode' in helpText,
+            }
+            entries[path] = caps
+            cache.save(entries)
+    _capabilities[engine] = caps
+    return caps
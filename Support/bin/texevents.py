@@ -0,0 +1,525 @@
+import sys
+import re
+import os
+import threading
+from struct import *
+
+# Events and renderers for the tex parsers.
+#
+# Parsers no longer print.  Every message they find becomes an Event which is
+# handed to a sink.  A sink is any object with emit(event) and flush() methods;
+# the renderers below are sinks that turn events into HTML for the TextMate
+# window, into JSON lines, or into plain compiler-style text.
+#
+# Renderers do not write every event as it comes: their output goes through a BufferedWriter,
+# which writes flushInterval seconds after the output came or when flushSize bytes are
+# waiting.  Errors are written at once, and parsers flush their sink when they are done.
+#
+# Event kinds:
+#   info, warning, fmtWarning, error   diagnostics; error and warning are counted
+#   fatal, alert                       shown as errors but not counted
+#   text                               an unmatched line, only sent in verbose mode
+#   file, include                      a new input file was opened / a file was used
+#   begin, end                         start (detail is 'latex' or 'bibtex') and end of a sub-run
+#   ltxmk, runSummary                  latexmk chatter and the per run totals
+#   transcript, badRun, summary        end of run: log file link, failed run, error total
+#   cached                             a program run was skipped because its inputs did not change
+#   profile                            per pattern counters of a parser in profiling mode (detail is a list of dicts)
+#   suppressed                         errors and warnings left out by an OutputBudget (detail is a dict with
+#                                      their numbers)
+#   warningGroup                       repeats of a warning or fmtWarning that was sent before, see
+#                                      WarningAggregator (detail is a dict with their kind, count and lines)
+
+
+def percent_escape(str):
+	return re.sub('[\x80-\xff /&]', lambda x: '%%%02X' % unpack('B', x.group(0))[0], str)
+
+def make_link(file, line):
+	return 'txmt://open?url=file:%2F%2F' + percent_escape(file) + '&amp;line=' + line
+
+
+def formatProfile(rows):
+    """Plain text table of the pattern counters in a profile event"""
+    lines = ['%9s %9s %10s %10s  %-24s %s' % ('attempts', 'hits', 'match ms', 'handler ms', 'handler', 'pattern')]
+    for row in rows:
+        pattern = row['pattern']
+        if len(pattern) > 60:
+            pattern = pattern[:57] + '...'
+        lines.append('%9d %9d %10.2f %10.2f  %-24s %s' % (row['attempts'], row['hits'], row['matchTime'] * 1000,
+                                                        row['handlerTime'] * 1000, row['handler'], pattern))
+    return '\n'.join(lines)
+
+
+flushInterval = 0.1
+flushSize = 16384
+
+class BufferedWriter(object):
+    """Collect output for a stream and write it in larger pieces.  A timer
+       writes what is waiting flushInterval seconds after it came, so output
+       does not sit in the buffer while the parser waits for its input."""
+    def __init__(self, stream, interval=None, size=None):
+        super(BufferedWriter, self).__init__()
+        self.stream = stream
+        self.interval = interval or flushInterval
+        self.size = size or flushSize
+        self.pieces = []
+        self.waiting = 0
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        self.lock.acquire()
+        try:
+            self.pieces.append(text)
+            self.waiting += len(text)
+            if self.waiting >= self.size:
+                self.writePieces()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.interval, self.flushLater)
+                self.timer.setDaemon(True)
+                self.timer.start()
+        finally:
+            self.lock.release()
+
+    def writePieces(self):
+        """Write what is waiting; the caller holds the lock"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.pieces:
+            self.stream.write(''.join(self.pieces))
+            self.pieces = []
+            self.waiting = 0
+        self.stream.flush()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self.writePieces()
+        finally:
+            self.lock.release()
+
+    def flushLater(self):
+        """Called by the timer.  A stream that went away is noticed by the next
+           write or flush of the parser, so the error is not reported here."""
+        try:
+            self.flush()
+        except (IOError, ValueError):
+            pass
+
+
+class Event(object):
+    """A single message found by a parser"""
+    __slots__ = ('kind', 'file', 'line', 'message', 'run', 'detail')
+    def __init__(self, kind, message, file=None, line=None, run=0, detail=None):
+        self.kind = kind
+        self.message = message
+        self.file = file
+        self.line = line
+        self.run = run
+        self.detail = detail
+
+    def asDict(self):
+        """Return the event as a dictionary, leaving out empty fields"""
+        d = {}
+        for key in self.__slots__:
+            value = getattr(self, key)
+            if value is not None:
+                d[key] = value
+        return d
+
+    def __repr__(self):
+        return 'Event(%r, %r, %r, %r)' % (self.kind, self.message, self.file, self.line)
+
+
+class EventSink(object):
+    """Base class for event sinks.  Discards everything."""
+    def emit(self, event):
+        pass
+
+    def flush(self):
+        pass
+
+
+class EventBuffer(EventSink):
+    """Keep events so they can be sent to another sink later, used to keep the
+       output of jobs that run at the same time apart"""
+    def __init__(self):
+        super(EventBuffer, self).__init__()
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+    def replay(self, sink):
+        for event in self.events:
+            sink.emit(event)
+        sink.flush()
+
+
+class WarningAggregator(EventSink):
+    """Collapse repeated warnings before they reach sink.  Warnings and
+       fmtWarnings are keyed by kind, file and message template (the message
+       with its numbers replaced).  The first warning of each template is sent
+       on at once; the ones after it are only counted, and sent on as one
+       warningGroup event per template before the next begin, end or summary
+       event, or when flushed."""
+    kinds = ('warning', 'fmtWarning')
+    boundaries = ('begin', 'end', 'runSummary', 'transcript', 'badRun', 'summary')
+    maxLines = 20           # line numbers kept per group
+    number = re.compile(r'(?<![A-Za-z_])\d+(?:\.\d+)?')
+
+    def __init__(self, sink):
+        super(WarningAggregator, self).__init__()
+        self.sink = sink
+        self.groups = {}
+        self.order = []
+
+    def template(self, message):
+        """'Overfull \\hbox (3.1pt too wide) in paragraph at lines 12--14' ->
+           'Overfull \\hbox (#pt too wide) in paragraph at lines #--#'"""
+        return self.number.sub('#', message)
+
+    def emit(self, event):
+        if event.kind in self.kinds:
+            key = (event.kind, event.file, self.template(event.message))
+            group = self.groups.get(key)
+            if group is None:
+                self.groups[key] = {'first' : event, 'count' : 0, 'lines' : [], 'more' : False}
+                self.order.append(key)
+                self.sink.emit(event)
+                return
+            group['count'] += 1
+            if event.line and event.line not in group['lines']:
+                if len(group['lines']) < self.maxLines:
+                    group['lines'].append(event.line)
+                else:
+                    group['more'] = True
+            return
+        if event.kind in self.boundaries:
+            self.release()
+        self.sink.emit(event)
+
+    def release(self):
+        """Send a warningGroup for every template that was repeated, in the order
+           the templates were first seen"""
+        for key in self.order:
+            group = self.groups[key]
+            if group['count']:
+                first = group['first']
+                self.sink.emit(Event('warningGroup', first.message, first.file, None, first.run,
+                                     {'kind' : first.kind, 'count' : group['count'], 'lines' : group['lines'],
+                                      'more' : group['more']}))
+        self.groups = {}
+        self.order = []
+
+    def flush(self):
+        self.release()
+        self.sink.flush()
+
+
+class OutputBudget(EventSink):
+    """Pass the first maxErrors errors and maxWarnings warnings of a run on to
+       sink and drop the rest, so a runaway log does not turn into megabytes of
+       output.  A warningGroup counts as one warning.  What was dropped is
+       reported in a suppressed event before the next begin, end or summary
+       event, or when flushed; then the count starts again.  A limit of 0 means
+       no limit.  Parsers count for themselves, their totals are not affected.
+       Alerts count as errors.  Fatal errors are always shown: they end the run,
+       so there are few of them, and they say why it ended."""
+    errorKinds = ('error', 'alert')
+    warningKinds = ('warning', 'fmtWarning', 'warningGroup')
+
+    def __init__(self, sink, maxErrors=0, maxWarnings=0):
+        super(OutputBudget, self).__init__()
+        self.sink = sink
+        self.maxErrors = maxErrors
+        self.maxWarnings = maxWarnings
+        self.reset()
+
+    def reset(self):
+        self.numErrs = 0
+        self.numWarns = 0
+        self.droppedErrs = 0
+        self.droppedWarns = 0
+
+    def emit(self, event):
+        if event.kind in self.errorKinds:
+            self.numErrs += 1
+            if self.maxErrors and self.numErrs > self.maxErrors:
+                self.droppedErrs += 1
+                return
+        elif event.kind in self.warningKinds:
+            self.numWarns += 1
+            if self.maxWarnings and self.numWarns > self.maxWarnings:
+                if event.kind == 'warningGroup':
+                    self.droppedWarns += event.detail['count']
+                else:
+                    self.droppedWarns += 1
+                return
+        elif event.kind in WarningAggregator.boundaries:
+            self.report()
+        self.sink.emit(event)
+
+    def report(self):
+        """Send a suppressed event if anything was dropped, and start counting again"""
+        if self.droppedErrs or self.droppedWarns:
+            self.sink.emit(Event('suppressed', '%d more errors and %d more warnings were not shown, '
+                                 'the log file has all of them.' % (self.droppedErrs, self.droppedWarns),
+                                 detail={'errors' : self.droppedErrs, 'warnings' : self.droppedWarns}))
+        self.reset()
+
+    def flush(self):
+        self.report()
+        self.sink.flush()
+
+
+class HtmlRenderer(EventSink):
+    """Render events as the HTML shown in the TextMate output window"""
+    urgent = ('error', 'fatal', 'alert', 'badRun')   # written at once
+
+    def __init__(self, stream):
+        super(HtmlRenderer, self).__init__()
+        self.stream = BufferedWriter(stream)
+        self.numErrs = 0       # numbers the #errorN anchors used by the >> button
+
+    def write(self, html):
+        self.stream.write(html + '\n')
+
+    def flush(self):
+        self.stream.flush()
+
+    def emit(self, event):
+        getattr(self, 'render_' + event.kind)(event)
+        if event.kind in self.urgent:
+            self.stream.flush()
+
+    def fileLink(self, event):
+        return make_link(os.path.join(os.getcwd(), event.file), str(event.line))
+
+    def render_text(self, event):
+        self.write(event.message)
+
+    def render_info(self, event):
+        self.write('<p class="info">\n%s\n</p>' % event.message)
+
+    def render_warning(self, event):
+        if event.file and event.line:
+            self.write('<p class="warning"><a href="' + self.fileLink(event) + '">' + event.message + '</a></p>')
+        else:
+            self.write('<p class="warning">\n%s\n</p>' % event.message)
+        if event.detail:
+            self.write('<pre>' + event.detail + '</pre>')
+
+    def render_fmtWarning(self, event):
+        self.write('<p class="fmtWarning">\n%s\n</p>' % event.message)
+
+    def render_warningGroup(self, event):
+        group = event.detail
+        if event.file:
+            path = os.path.join(os.getcwd(), event.file)
+            lines = ['<a href="%s">%s</a>' % (make_link(path, str(line)), line) for line in group['lines']]
+        else:
+            lines = [str(line) for line in group['lines']]
+        if group['more']:
+            lines.append('...')
+        text = '%d more like this' % group['count']
+        if lines:
+            text += '<span class="warningLines">: lines %s</span>' % ', '.join(lines)
+        if group['kind'] == 'fmtWarning':
+            self.write('<p class="fmtWarning">\n%s\n</p>' % text)
+        else:
+            self.write('<p class="warningGroup">\n%s\n</p>' % text)
+
+    def render_error(self, event):
+        anchor = '<a href="#error%d" style="text-decoration:none;">Error Latex:</a><a name="error%d"  style="position:relative; top:-10px;">&nbsp;</a>' % (self.numErrs + 1, self.numErrs)
+        if event.file and event.line:
+            link = re.sub("%2F", "/", self.fileLink(event))
+            self.write('<p class="error">\n' + anchor)
+            self.write(' <a id="errorlink%d"' % self.numErrs)
+            self.write('href="' + link + '">' + event.file + ':' + str(event.line) + '</a> ' + event.message + '</p>')
+            if event.detail:
+                self.write('<pre>' + event.detail + '</pre>')
+        elif event.detail is not None:
+            self.write('<p class="error">\n' + anchor)
+            self.write('<a id="errorlink%d"' % self.numErrs)
+            self.write('href="#error0">' + event.message + '</a>' + event.detail + '\n</p>')
+        else:
+            self.write('<p class="error">\n%s\n</p>' % event.message)
+        self.numErrs += 1
+
+    def render_fatal(self, event):
+        if event.detail:
+            self.write('<p class="error">\n%s\n%s\n</p>' % (event.message, event.detail))
+        else:
+            self.write('<p class="error">\n%s\n</p>' % event.message)
+
+    def render_alert(self, event):
+        self.write('<p class="error">\n' + event.message)
+        if event.detail:
+            self.write('<pre>    ' + event.detail + '</pre>')
+        self.write('</p>')
+
+    def render_file(self, event):
+        self.write("<h4>Processing: " + event.file + "</h4>")
+
+    def render_include(self, event):
+        self.write("<ul><li>Including: " + event.message + "\n</li></ul>")
+
+    def render_begin(self, event):
+        self.write('<div class="%s">' % event.detail)
+        if event.detail == 'latex':
+            self.write('<hr>')
+        self.write('<h3>' + event.message + '</h3>')
+
+    def render_end(self, event):
+        self.write('</div>')
+
+    def render_cached(self, event):
+        self.write('<p class="info">%s: %s</p>' % (event.file, event.message))
+
+    def render_profile(self, event):
+        self.write('<p class="info">%s</p>' % event.message)
+        self.write('<pre class="profile">%s</pre>' % formatProfile(event.detail).replace('&', '&amp;').replace('<', '&lt;'))
+
+    def render_suppressed(self, event):
+        self.write('<p class="info">%s</p>' % event.message)
+
+    def render_ltxmk(self, event):
+        self.write('<p class="ltxmk">%s</p>' % event.message)
+
+    def render_runSummary(self, event):
+        self.write('<hr />\n<p> %s </p>' % event.message)
+
+    def render_transcript(self, event):
+        self.write('<p>  Complete transcript is in \n<a href="' + self.fileLink(event) + '">' + event.file + '</a>\n</p>')
+
+    def render_badRun(self, event):
+        self.write('<p class="error">A fatal error occured, log file is in \n<a href="' + self.fileLink(event) + '">' + event.file + '</a>\n</p>')
+
+    def render_summary(self, event):
+        self.write('<script>'
+                'function firstError() {'
+                    'if (document.getElementById("errorlink0")) document.location.href = "#error0";'
+                    'else {'
+                        'document.location.href = "#errorsummary";'
+                        '(elem=document.getElementById("fastfinder")).parentNode.removeChild(elem);}};'
+                'var i = 0;'
+                'function nextError() {'
+                    'document.location.href = "#error"+i;'
+                    'if (link=document.getElementById("errorlink"+i)) document.location = link.getAttribute("href");'
+                    'else {(elem=document.getElementById("fastfinder")).parentNode.removeChild(elem);'
+                        'document.location.href = "#errorsummary"}'
+                    'i = i+1;  }'
+                'document.addEventListener("DOMContentLoaded", firstError, false);'
+            '</script>')
+        self.write('<div id="fastfinder" style="background-color:transparent;"><form><input type="button" id="nexterror" style="text-decoration:none;" onClick="nextError();" value=">>"></form></div>')
+        self.write("<p class='info'>Found <a name=\"errorsummary\" href=\"#error0\">" + event.message + "</a> errors.</p>")
+        self.write('</div>') # watchdocument errors
+
+
+def decodeText(value):
+    """Byte strings in value as unicode: UTF-8 where they are valid UTF-8, Latin-1
+       otherwise.  Logs of documents with 8-bit input encodings hold both."""
+    if isinstance(value, str):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return value.decode('latin-1')
+    if isinstance(value, (list, tuple)):
+        return [decodeText(v) for v in value]
+    if isinstance(value, dict):
+        return dict([(decodeText(k), decodeText(v)) for k, v in value.items()])
+    return value
+
+
+class JsonLinesRenderer(EventSink):
+    """Write one JSON object per event, for scripts and CI"""
+    def __init__(self, stream):
+        super(JsonLinesRenderer, self).__init__()
+        import json
+        self.dumps = json.dumps
+        self.stream = BufferedWriter(stream)
+
+    def emit(self, event):
+        self.stream.write(self.dumps(decodeText(event.asDict())) + '\n')
+        if event.kind in HtmlRenderer.urgent:
+            self.stream.flush()
+
+    def flush(self):
+        self.stream.flush()
+
+
+class TextRenderer(EventSink):
+    """Write diagnostics as plain file:line: kind: message lines"""
+    kinds = ('info', 'warning', 'fmtWarning', 'error', 'fatal', 'alert', 'text', 'badRun', 'cached', 'profile',
+             'warningGroup', 'suppressed')
+
+    def __init__(self, stream):
+        super(TextRenderer, self).__init__()
+        self.stream = BufferedWriter(stream)
+
+    def emit(self, event):
+        if event.kind not in self.kinds:
+            return
+        if event.kind in HtmlRenderer.urgent:
+            self.render(event)
+            self.stream.flush()
+        else:
+            self.render(event)
+
+    def render(self, event):
+        if event.kind == 'text':
+            self.stream.write(event.message + '\n')
+            return
+        if event.kind == 'profile':
+            self.stream.write(event.message + '\n' + formatProfile(event.detail) + '\n')
+            return
+        if event.kind == 'suppressed':
+            self.stream.write(event.message + '\n')
+            return
+        kind, message, detail = event.kind, event.message, event.detail
+        if kind == 'warningGroup':
+            group = event.detail
+            kind, detail = group['kind'], None
+            lines = [str(line) for line in group['lines']] + (group['more'] and ['...'] or [])
+            message = '%d more like "%s"%s' % (group['count'], message, lines and ', lines ' + ', '.join(lines) or '')
+        where = ''
+        if event.file:
+            where = event.file + ':'
+            if event.line:
+                where += str(event.line) + ':'
+            where += ' '
+        self.stream.write('%s%s: %s\n' % (where, kind, message))
+        if detail and detail.strip():
+            self.stream.write('    ' + detail.strip() + '\n')
+
+    def flush(self):
+        self.stream.flush()
+
+
+renderers = {
+    'html' : HtmlRenderer,
+    'json' : JsonLinesRenderer,
+    'text' : TextRenderer,
+}
+
+def makeRenderer(format, stream=None):
+    """Return a renderer for format ('html', 'json' or 'text') writing to stream"""
+    if stream is None:
+        stream = sys.stdout
+    return renderers[format](stream)
+
+_defaultSink = None
+
+def getDefaultSink():
+    """The sink used by parsers that are not given one: HTML on stdout unless
+       setDefaultSink has been called."""
+    global _defaultSink
+    if _defaultSink is None:
+        _defaultSink = HtmlRenderer(sys.stdout)
+    return _defaultSink
+
+def setDefaultSink(sink):
+    global _defaultSink
+    _defaultSink = sink
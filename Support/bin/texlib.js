@@ -96,3 +96,17 @@ function makeLatexmkVisible() {
         warnElements[i].style.display = (warnElements[i].style.display == "none" || warnElements[i].style.display == "" ? "block" : "none");
     }
 }
+
+function makeTimingVisible() {
+    var timingElements = getElementsByClassName("*","timing");
+    for(var i=0;i<timingElements.length;i++) {
+        timingElements[i].style.display = (timingElements[i].style.display == "none" || timingElements[i].style.display == "" ? "block" : "none");
+    }
+}
+
+function makeWarningLinesVisible() {
+    var lineElements = getElementsByClassName("*","warningLines");
+    for(var i=0;i<lineElements.length;i++) {
+        lineElements[i].style.display = (lineElements[i].style.display == "none" || lineElements[i].style.display == "" ? "inline" : "none");
+    }
+}
@@ -2,103 +2,275 @@ import sys
 import re
 import os.path
 import os
+import time
 import tmprefs
 from struct import *
+from texevents import Event, OutputBudget, WarningAggregator, getDefaultSink, percent_escape, make_link
 
 
-def percent_escape(str):
-	return re.sub('[\x80-\xff /&]', lambda x: '%%%02X' % unpack('B', x.group(0))[0], str)
-
-def make_link(file, line):
-	return 'txmt://open?url=file:%2F%2F' + percent_escape(file) + '&amp;line=' + line
-
 def shell_quote(string):
 	return '"' + re.sub(r'([`$\\"])', r'\\\1', string) + '"'
 
+_combinedPatterns = {}
+
+def combine_patterns(patterns):
+	"""Fold a list of compiled patterns into one alternation of named groups.
+	   Python tries the alternatives left to right, so the first pattern that
+	   matches wins, exactly as if they were tried one at a time.  Returns None
+	   if the patterns cannot be combined (mixed flags, too many groups)."""
+	key = tuple([(p.pattern, p.flags) for p in patterns])
+	if key in _combinedPatterns:
+		return _combinedPatterns[key]
+	combined = None
+	flags = set([p.flags for p in patterns])
+	if len(flags) == 1:
+		try:
+			combined = re.compile('|'.join(['(?P<_p%d>%s)' % (i, p.pattern) for i, p in enumerate(patterns)]), flags.pop())
+		except (re.error, AssertionError, OverflowError):
+			combined = None
+	_combinedPatterns[key] = combined
+	return combined
+
+
+class PatternDispatcher(object):
+    """Match lines against an ordered list of (pattern, method) pairs.
+       Lines are first tried against a single combined regular expression, so
+       a line that matches nothing costs one match instead of one per pattern.
+       Only on a hit is the winning pattern re-run to get its own groups."""
+    def __init__(self, patterns):
+        super(PatternDispatcher, self).__init__()
+        self.patterns = list(patterns)
+        self.combined = None
+        if self.patterns:
+            self.combined = combine_patterns([pat for pat,fun in self.patterns])
+
+    def match(self, line):
+        """Return (match, method) for the first pattern matching line, or None"""
+        if self.combined is None:
+            for pat,fun in self.patterns:
+                myMatch = pat.match(line)
+                if myMatch:
+                    return myMatch, fun
+            return None
+        myMatch = self.combined.match(line)
+        if not myMatch:
+            return None
+        pat,fun = self.patterns[int(myMatch.lastgroup[2:])]
+        return pat.match(line), fun
+
+
+class ParseProfile(object):
+    """Counters collected by a parser in profiling mode"""
+    def __init__(self):
+        super(ParseProfile, self).__init__()
+        self.patterns = {}      # (pattern, handler name) -> [attempts, hits, match time, handler time]
+        self.order = []
+        self.unmatched = 0
+        self.rewrapCalls = 0
+        self.rewrapTime = 0.0
+
+    def counters(self, pat, fun):
+        key = (pat.pattern, fun.__name__)
+        if key not in self.patterns:
+            self.patterns[key] = [0, 0, 0.0, 0.0]
+            self.order.append(key)
+        return self.patterns[key]
+
+    def rows(self):
+        """One dictionary per pattern, in the order they are tried"""
+        rows = []
+        for key in self.order:
+            pattern = re.sub('[\x00-\x1f\x7f-\xff]', lambda m: '\\x%02x' % ord(m.group(0)), key[0])
+            rows.append(dict(zip(('pattern', 'handler', 'attempts', 'hits', 'matchTime', 'handlerTime'),
+                                 (pattern, key[1]) + tuple(self.patterns[key]))))
+        return rows
+
+
+class ProfilingDispatcher(PatternDispatcher):
+    """A PatternDispatcher that tries the patterns one at a time, so the cost of
+       each pattern and of the method it calls can be counted.  Handler time
+       includes everything the handler does, such as a nested parser's run."""
+    def __init__(self, patterns, profile):
+        super(ProfilingDispatcher, self).__init__(patterns)
+        self.profile = profile
+        self.counters = [profile.counters(pat, fun) for pat,fun in self.patterns]
+
+    def match(self, line):
+        for i in range(len(self.patterns)):
+            pat,fun = self.patterns[i]
+            counters = self.counters[i]
+            start = time.time()
+            myMatch = pat.match(line)
+            counters[0] += 1
+            counters[2] += time.time() - start
+            if myMatch:
+                counters[1] += 1
+                return myMatch, self.timed(fun, counters)
+        self.profile.unmatched += 1
+        return None
+
+    def timed(self, fun, counters):
+        return TimedHandler(fun, counters)
+
+
+class TimedHandler(object):
+    """Call a pattern's method and add the time it took to its counters.  Compares
+       equal to the method, LaTexParser checks which handler it was given."""
+    def __init__(self, fun, counters):
+        self.fun = fun
+        self.counters = counters
+
+    def __call__(self, *args):
+        start = time.time()
+        try:
+            return self.fun(*args)
+        finally:
+            self.counters[3] += time.time() - start
+
+    def __eq__(self, other):
+        return self.fun == other
+
+    def __ne__(self, other):
+        return self.fun != other
+
 
 class TexParser(object):
     """Master Class for Parsing Tex Typsetting Streams"""
-    def __init__(self, input_stream, verbose):
+    maxStatementLength = 16384      # longest rewrapped statement handed to the patterns
+    truncationMarker = ' [...]'
+    def __init__(self, input_stream, verbose, sink=None):
         super(TexParser, self).__init__()
         self.input_stream = input_stream
+        if sink is None:
+            sink = getDefaultSink()
+        if not verbose and not isinstance(sink, WarningAggregator):
+            sink = WarningAggregator(sink)      # verbose output keeps every warning in place
+        self.sink = sink
+        self.run = 0
         self.patterns = []
         self.done = False
         self.verbose = verbose
         self.numErrs = 0
         self.numWarns = 0
         self.isFatal = False
+        self.abortOnFatal = False   # stop reading once a fatal error is seen
         self.fileStack = []  #TODO: long term - can improve currentFile handling by keeping track of (xxx and )
+        self.dispatcher = None
+        self.profile = None
+        if os.getenv('TM_LATEX_PROFILE'):
+            self.enableProfiling()
+
+    def emit(self, kind, message, file=None, line=None, detail=None):
+        """Send an Event for this run to the sink"""
+        self.sink.emit(Event(kind, message, file, line, self.run, detail))
+
+    def getDispatcher(self):
+        """Return a PatternDispatcher for the current patterns list.  Subclasses
+           extend or replace self.patterns after __init__, so build it lazily."""
+        if self.dispatcher is None or self.dispatcher.patterns != self.patterns:
+            if self.profile is None:
+                self.dispatcher = PatternDispatcher(self.patterns)
+            else:
+                self.dispatcher = ProfilingDispatcher(self.patterns, self.profile)
+        return self.dispatcher
+
+    def enableProfiling(self):
+        """Count attempts, hits and time for every pattern and its method, and the
+           time spent rewrapping lines.  parseStream emits the numbers as a
+           'profile' event when it is done.  Switched on by TM_LATEX_PROFILE."""
+        self.profile = profile = ParseProfile()
+        self.dispatcher = None
+        rewrap = self.getRewrappedLine
+        def timedRewrap():
+            start = time.time()
+            line = rewrap()
+            profile.rewrapCalls += 1
+            profile.rewrapTime += time.time() - start
+            return line
+        self.getRewrappedLine = timedRewrap
+
+    def emitProfile(self):
+        p = self.profile
+        self.emit('profile', '%s: %d statements, %d unmatched, rewrapping took %.1f ms'
+                  % (self.__class__.__name__, p.rewrapCalls, p.unmatched, p.rewrapTime * 1000),
+                  detail=p.rows())
 
     def getRewrappedLine(self):
         """Sometimes TeX breaks up lines with hard linebreaks.  This is annoying.
            Even more annoying is that it sometime does not break line, for two distinct 
-           warnings. This function attempts to return a single statement."""
-        statement = ""
+           warnings. This function attempts to return a single statement.
+           Pieces are collected in a list and joined once, and a statement longer
+           than maxStatementLength is cut off with truncationMarker while the rest
+           of its wrapped lines are read and thrown away."""
+        pieces = []
+        length = 0
+        truncated = False
         while True:
             line = self.input_stream.readline()
             if not line:
-                if statement: 
-                    return statement
-                else:
-                    return ""
-            statement += line.rstrip("\n")
+                break
+            if not truncated:
+                piece = line.rstrip("\n")
+                if length + len(piece) > self.maxStatementLength:
+                    piece = piece[:self.maxStatementLength - length]
+                    truncated = True
+                pieces.append(piece)
+                length += len(piece)
             if len(line) != 80: # including line break
                 break
+        if truncated:
+            pieces.append(self.truncationMarker)
+        statement = "".join(pieces)
+        if not line:
+            return statement
         return statement+"\n"
     
     def parseStream(self):
         """Process the input_stream one line at a time, matching against
            each pattern in the patterns dictionary.  If a pattern matches
            call the corresponding method in the dictionary.  The dictionary
-           is organized with patterns as the keys and methods as the values."""
+           is organized with patterns as the keys and methods as the values.
+           All patterns are tried in one pass by a PatternDispatcher.
+           The sink decides when its output is written; it is flushed at the end."""
+        dispatch = self.getDispatcher().match
         line = self.getRewrappedLine()
-        while line and not self.done:
+        while line and not self.done and not (self.isFatal and self.abortOnFatal):
             line = line.rstrip("\n")
             foundMatch = False
             
-
-            # process matching patterns until we find one
-            for pat,fun in self.patterns:
-                myMatch = pat.match(line)
-                if myMatch:
-                    fun(myMatch,line)
-                    sys.stdout.flush()
-                    foundMatch = True
-                    break
+            # find the first matching pattern
+            hit = dispatch(line)
+            if hit:
+                myMatch,fun = hit
+                fun(myMatch,line)
+                foundMatch = True
             if self.verbose and not foundMatch:
-                print line
+                self.emit('text', line)
             
             line = self.getRewrappedLine()
         if self.done == False:
             self.badRun()
+        if self.profile is not None:
+            self.emitProfile()
+        self.sink.flush()
         return self.isFatal, self.numErrs, self.numWarns
 
     def info(self,m,line):
-        print '<p class="info">'
-        print line
-        print '</p>'
+        self.emit('info', line)
 
     def error(self,m,line):
-        print '<p class="error">'
-        print line
-        print '</p>'
+        self.emit('error', line)
         self.numErrs += 1
         
     def warning(self,m,line):
-        print '<p class="warning">'
-        print line
-        print '</p>'
+        self.emit('warning', line)
         self.numWarns += 1
 
     def warn2(self,m,line):
-        print '<p class="fmtWarning">'
-        print line
-        print '</p>'
+        self.emit('fmtWarning', line)
         
     def fatal(self,m,line):
-        print '<p class="error">'
-        print line
-        print '</p>'
+        self.emit('fatal', line)
         self.isFatal = True
 
     def badRun(self):
@@ -107,8 +279,8 @@ class TexParser(object):
         
 class BibTexParser(TexParser):
     """Parse and format Error Messages from bibtex"""
-    def __init__(self, btex, verbose):
-        super(BibTexParser, self).__init__(btex,verbose)
+    def __init__(self, btex, verbose, sink=None):
+        super(BibTexParser, self).__init__(btex,verbose,sink)
         self.patterns += [ 
             (re.compile("Warning--I didn't find a database entry") , self.warning),
             (re.compile(r'I found no \\\w+ command') , self.error),
@@ -121,12 +293,12 @@ class BibTexParser(TexParser):
     
     def finishRun(self,m,line):
         self.done = True
-        print '</div>'
+        self.emit('end', line)
 
 class LaTexParser(TexParser):
     """Parse Output From Latex"""
-    def __init__(self, input_stream, verbose, fileName):
-        super(LaTexParser, self).__init__(input_stream,verbose)
+    def __init__(self, input_stream, verbose, fileName, sink=None):
+        super(LaTexParser, self).__init__(input_stream,verbose,sink)
         self.suffix = fileName[fileName.rfind('.')+1:]
         self.currentFile = fileName
         self.patterns += [
@@ -136,6 +308,8 @@ class LaTexParser(TexParser):
             (re.compile('.*\<use (.*?)\>') , self.detectInclude),
             (re.compile('^Output written') , self.info),
             (re.compile('LaTeX Warning:.*?input line (\d+)(\.|$)') , self.handleWarning),
+            (re.compile('(LaTeX|Package [\w\-]+) Warning:.*(Rerun|may have changed)') , self.handleRerunWarning),
+            (re.compile('\([\w\-]+\)\s+Rerun') , self.handleRerunWarning),
             (re.compile('LaTeX Warning:.*') , self.warning),
             (re.compile('^([^:]*):(\d+):\s+(pdfTeX warning.*)') , self.handleFileLineWarning),            
             (re.compile('.*pdfTeX warning.*') , self.warning),            
@@ -152,76 +326,93 @@ class LaTexParser(TexParser):
             (re.compile('^\s+==>') , self.fatal)
         ]
         self.blankLine = re.compile(r'^\s*$')        
+        self.rerunRequested = False
 
     def parseStream(self):
         """Process the input_stream one line at a time, matching against
            each pattern in the patterns dictionary.  If a pattern matches
            call the corresponding method in the dictionary.  The dictionary
-           is organized with patterns as the keys and methods as the values."""
+           is organized with patterns as the keys and methods as the values.
+           All patterns are tried in one pass by a PatternDispatcher.
+           The sink decides when its output is written; it is flushed at the end."""
+        dispatch = self.getDispatcher().match
         line = self.getRewrappedLine()
         waitForNextLine = False
         lastLine = ""
         lastMatch = ""
-        while line and not self.done:
+        while line and not self.done and not (self.isFatal and self.abortOnFatal):
             line = line.rstrip("\n")
             foundMatch = False
             
             if waitForNextLine:
                 waitForNextLine = False
                 lastFun(lastMatch,lastLine, line)
-                sys.stdout.flush()
                 foundMatch = True
-            # process matching patterns until we find one
-            for pat,fun in self.patterns:
-                myMatch = pat.match(line)
-                if myMatch:
-                    if fun == self.myHandleError or fun == self.myHandleOldStyleErrors:
-                        lastFun = fun
-                        lastMatch = myMatch
-                        lastLine = line
-                        waitForNextLine = True
-                    else:
-                        fun(myMatch,line)
-                        sys.stdout.flush()
-                        foundMatch = True
-                    break
+                if self.isFatal and self.abortOnFatal:
+                    break       # don't wait for TeX to print another line
+            # find the first matching pattern
+            hit = dispatch(line)
+            if hit:
+                myMatch,fun = hit
+                if fun == self.myHandleError or fun == self.myHandleOldStyleErrors:
+                    lastFun = fun
+                    lastMatch = myMatch
+                    lastLine = line
+                    waitForNextLine = True
+                else:
+                    fun(myMatch,line)
+                    foundMatch = True
             if self.verbose and not foundMatch:
-                print line
+                self.emit('text', line)
             
             line = self.getRewrappedLine()
         if self.done == False:
             self.badRun()
+        if self.profile is not None:
+            self.emitProfile()
+        self.sink.flush()
         return self.isFatal, self.numErrs, self.numWarns
     
     def detectNewFile(self,m,line):
         self.currentFile = m.group(1).rstrip()
-        print "<h4>Processing: " + self.currentFile + "</h4>"
+        self.emit('file', line, file=self.currentFile)
 
     def detectInclude(self,m,line):
-        print "<ul><li>Including: " + m.group(1)
-        print "</li></ul>"
+        self.emit('include', m.group(1))
 
     def handleWarning(self,m,line):
-        print '<p class="warning"><a href="' + make_link(os.path.join(os.getcwd(),self.currentFile), m.group(1)) + '">'+line+"</a></p>"
+        self.emit('warning', line, file=self.currentFile, line=m.group(1))
         self.numWarns += 1
     
+    def warn2(self,m,line):
+        """Overfull and underfull boxes, with the file and first line of the paragraph"""
+        lines = re.search(r'lines? (\d+)', line)
+        self.emit('fmtWarning', line, file=self.currentFile, line=lines and lines.group(1))
+
+    def handleRerunWarning(self,m,line):
+        """LaTeX or a package asks for another run, in a warning or in the
+           (package) continuation line of one.  Only LaTeX's own warnings are
+           shown and counted, as before."""
+        self.rerunRequested = True
+        if line.startswith('LaTeX Warning'):
+            self.warning(m,line)
+
     def handleFileLineWarning(self,m,line):
         """Display warning. match m should contain file, line, warning message"""
-        print '<p class="warning"><a href="' + make_link(os.path.join(os.getcwd(), m.group(1)),m.group(2)) + '">' + m.group(3) + "</a></p>"
+        self.emit('warning', m.group(3), file=m.group(1), line=m.group(2))
         self.numWarns += 1
     
     def handleError(self,m,line):
-        print '<p class="error">'
-        print 'Latex Error: <a  href="' + make_link(os.path.join(os.getcwd(),m.group(1)),m.group(2)) +  '">' + m.group(1)+":"+m.group(2) + '</a> '+m.group(3)+'</p>'
+        self.emit('error', m.group(3), file=m.group(1), line=m.group(2))
         self.numErrs += 1
+        if m.group(3).startswith('Emergency stop'):
+            self.isFatal = True
     
     
     def getFileName(self, line):
         return re.sub("\./","",line)
     
     def myHandleError(self,m,line,nextline):
-        print '<p class="error">'
-        
         line = m.group(3)
         if re.search('Undefined control sequence', line):
             match = re.search(r'\\\w+$',nextline)
@@ -229,34 +420,23 @@ class LaTexParser(TexParser):
                 line = "Undefined control sequence: " + match.group(0)
             elif nextline and len(nextline.strip()) > 0:
                 line = "Undefined control sequence: " + nextline
-        # Verschiebung nach oben war notwendig als es noch das fixierte Banner gab
-        #print '<a name="error%d" style="position:relative; top:-75px;">&nbsp;</a><a href="#error%d" style="text-decoration:none;">Latex Error:</a>' % (self.numErrs, self.numErrs + 1)
-        print '<a href="#error%d" style="text-decoration:none;">Error Latex:</a><a name="error%d"  style="position:relative; top:-10px;">&nbsp;</a>' % (self.numErrs + 1, self.numErrs)
-        print ' <a id="errorlink%d"' % self.numErrs
         file = self.getFileName(m.group(1))
-        link = re.sub("%2F","/",make_link(os.path.join(os.getcwd(),file),m.group(2)))
-        print 'href="' + link +  '">' + file +":"+m.group(2) + '</a> '+ line +'</p>'
+        self.emit('error', line, file=file, line=m.group(2))
         self.numErrs += 1
+        if line.startswith('Emergency stop'):
+            self.isFatal = True
         
         
     def finishRun(self,m,line):
         logFile = m.group(1).strip('"')
-        print '<p>  Complete transcript is in '
-        print '<a href="' + make_link(os.path.join(os.getcwd(),logFile),'1') +  '">' + logFile + '</a>'
-        print '</p>'
+        self.emit('transcript', logFile, file=logFile, line='1')
         self.done = True
 
     def handleOldStyleErrors(self,m,line):
         if re.search('[Ee]rror', line):
-            print '<p class="error">'
-            print line
-            print '</p>'
-            self.numErrs += 1
+            self.error(m,line)
         else:
-            print '<p class="warning">'
-            print line
-            print '</p>'
-            self.numWarns += 1
+            self.warning(m,line)
         
     def myHandleOldStyleErrors(self,m,line,nextline):
         if re.search('Undefined control sequence', line):
@@ -266,47 +446,31 @@ class LaTexParser(TexParser):
         if nextline and not len(nextline.strip()) > 0:
             nextline = ': ' + nextline
             
-        print '<p class="error">'
-        print '<a href="#error%d" style="text-decoration:none;">Error Latex:</a><a name="error%d"  style="position:relative; top:-10px;">&nbsp;</a>' % (self.numErrs + 1, self.numErrs)
-        print '<a id="errorlink%d"' % self.numErrs
-        #print 'href="' + make_link(os.path.join(os.getcwd(),m.group(1)),m.group(2)) +  '">' + m.group(1)+":"+m.group(2) + '</a> '+m.group(3) + nextline +'</p>'
-        #print line
-        print 'href="#error0">' + line + '</a>' + nextline
-#        print line + nextline
-        print '</p>'
+        self.emit('error', line, detail=nextline)
         self.numErrs += 1
 
         
     def pdfLatexError(self,m,line):
         """docstring for pdfLatexError"""
-        print '<p class="error">'
-        #print '<a href="#error%d" style="text-decoration:none;">Error pdfLatex:</a><a name="error%d"  style="position:relative; top:-10px;">&nbsp;</a>' % (self.numErrs + 1, self.numErrs)
-        print line
-        line = self.input_stream.readline()
-        if line and re.match('^ ==> Fatal error occurred', line):  
-            print line.rstrip("\n")
-            print '</p>'
+        nextline = self.input_stream.readline()
+        if nextline and re.match('^ ==> Fatal error occurred', nextline):  
+            self.emit('fatal', line, detail=nextline.rstrip("\n"))
             self.isFatal = True
         else:
-            if line:
-                print '<pre>    '+ line.rstrip("\n") + '</pre>'
-            print '</p>'    
-        #self.numErrs += 1 # Nicht mitzaehlen. Da diese Fehler keinen Link haben, funktioniert sonst der Pfeil-Button nicht.
-        sys.stdout.flush()
+            self.emit('alert', line, detail=nextline.rstrip("\n"))
+        # Nicht mitzaehlen. Da diese Fehler keinen Link haben, funktioniert sonst der Pfeil-Button nicht.
     
     def badRun(self):
         """docstring for finishRun"""
-        print '<p class="error">A fatal error occured, log file is in '
         logFile = os.path.basename(os.getenv('TM_FILEPATH'))
         logFile = logFile.replace(self.suffix,'log')
-        print '<a href="' + make_link(os.path.join(os.getcwd(),logFile),'1') +  '">' + logFile + '</a>'        
-        print '</p>'
+        self.emit('badRun', logFile, file=logFile, line='1')
 
         
 class WatchDocumentParser(LaTexParser):
     """Parse Output From Latex"""
-    def __init__(self, input_stream, verbose, fileName):
-        super(WatchDocumentParser, self).__init__(input_stream,verbose,fileName)
+    def __init__(self, input_stream, verbose, fileName, sink=None):
+        super(WatchDocumentParser, self).__init__(input_stream,verbose,fileName,sink)
         self.suffix = fileName[fileName.rfind('.')+1:]
         self.currentFile = fileName
         self.patterns = [
@@ -352,40 +516,21 @@ class WatchDocumentParser(LaTexParser):
         #print '</div>' # watchdocument errors
     
     def summary(self):
-        print('<script>'
-                'function firstError() {' 
-                    'if (document.getElementById("errorlink0")) document.location.href = "#error0";'
-                    'else {'
-                        'document.location.href = "#errorsummary";' 
-                        '(elem=document.getElementById("fastfinder")).parentNode.removeChild(elem);}};' 
-                'var i = 0;' 
-                'function nextError() {' 
-                    'document.location.href = "#error"+i;' 
-                    'if (link=document.getElementById("errorlink"+i)) document.location = link.getAttribute("href");' 
-                    'else {(elem=document.getElementById("fastfinder")).parentNode.removeChild(elem);'
-                        'document.location.href = "#errorsummary"}' 
-                    'i = i+1;  }'
-                'document.addEventListener("DOMContentLoaded", firstError, false);'
-            '</script>')
-        print '<div id="fastfinder" style="background-color:transparent;"><form><input type="button" id="nexterror" style="text-decoration:none;" onClick="nextError();" value=">>"></form></div>'
-        print "<p class='info'>Found <a name=\"errorsummary\" href=\"#error0\">" + str(self.numErrs) + "</a> errors.</p>"
-        print '</div>' # watchdocument errors
+        self.emit('summary', str(self.numErrs), detail=self.numErrs)
         #print "<!--"
         
         
     
     def finishRun(self,m,line):
-        print '<p class="info">'
-        print line
-        print '</p>'
+        self.info(m,line)
         self.done = True
         self.summary()
 
 
 class ParseLatexMk(TexParser):
     """docstring for ParseLatexMk"""
-    def __init__(self, input_stream, verbose,filename):
-        super(ParseLatexMk, self).__init__(input_stream,verbose)
+    def __init__(self, input_stream, verbose,filename, sink=None):
+        super(ParseLatexMk, self).__init__(input_stream,verbose,sink)
         self.fileName = filename
         self.patterns += [
             (re.compile('This is (pdfTeX|latex2e|latex|XeTeX)') , self.startLatex),
@@ -398,41 +543,40 @@ class ParseLatexMk(TexParser):
         self.numRuns = 0
     
     def startBibtex(self,m,line):
-        print '<div class="bibtex">'
-        print '<h3>' + line[:-1] + '</h3>'
-        bp = BibTexParser(self.input_stream,self.verbose)
+        self.emit('begin', line[:-1], detail='bibtex')
+        bp = BibTexParser(self.input_stream,self.verbose,self.sink)
+        bp.run = self.numRuns
         f,e,w = bp.parseStream()
         self.numErrs += e
         self.numWarns += w
 
     def startLatex(self,m,line):
-        print '<div class="latex">'
-        print '<hr>'
-        print '<h3>' + line[:-1] + '</h3>'
-        bp = LaTexParser(self.input_stream,self.verbose,self.fileName)
+        self.emit('begin', line[:-1], detail='latex')
+        bp = LaTexParser(self.input_stream,self.verbose,self.fileName,self.sink)
+        bp.run = self.numRuns
         f,e,w = bp.parseStream()
         self.numErrs += e
         self.numWarns += w
 
     def newRun(self,m,line):
         if self.numRuns > 0:
-            print '<hr />'
-            print '<p>', self.numErrs, 'Errors', self.numWarns, 'Warnings', 'in this run.', '</p>'
+            self.emit('runSummary', '%d Errors %d Warnings in this run.' % (self.numErrs, self.numWarns))
         self.numWarns = 0
         self.numErrs = 0
         self.numRuns += 1
+        self.run = self.numRuns
 
     def finishRun(self,m,line):
         self.ltxmk(m,line)
         self.done = True
 
     def ltxmk(self,m,line):
-        print '<p class="ltxmk">%s</p>'%line
+        self.emit('ltxmk', line)
 
 class ChkTeXParser(TexParser):
     """Parse the output from chktex"""
-    def __init__(self, input_stream, verbose, filename):
-        super(ChkTeXParser, self).__init__(input_stream,verbose)
+    def __init__(self, input_stream, verbose, filename, sink=None):
+        super(ChkTeXParser, self).__init__(input_stream,verbose,sink)
         self.fileName = filename
         self.patterns += [
             (re.compile('^ChkTeX') , self.info),
@@ -443,25 +587,76 @@ class ChkTeXParser(TexParser):
 
     def handleWarning(self,m,line):
         """Display warning. match m should contain file, line, warning message"""
-        print '<p class="warning">Warning: <a href="' + make_link(os.path.join(os.getcwd(), m.group(1)),m.group(2)) + '">' + m.group(1)+ ": "+m.group(2)+":</a>"+m.group(3)+"</p>"
         warnDetail = self.input_stream.readline()
         if len(warnDetail) > 2:
-            print '<pre>',warnDetail[:-1]
-            print self.input_stream.readline()[:-1], '</pre>'
+            warnDetail = warnDetail[:-1] + '\n' + self.input_stream.readline()[:-1]
+        else:
+            warnDetail = None
+        self.emit('warning', line, file=m.group(1), line=m.group(2), detail=warnDetail)
         self.numWarns += 1
 
     def handleError(self,m,line):
-        print '<p class="error">'
-        print 'Error: <a  href="' + make_link(os.path.join(os.getcwd(),m.group(1)),m.group(2)) +  '">' + m.group(1)+":"+m.group(2) + ':</a> '+m.group(3)+'</p>'
-        print '<pre>', self.input_stream.readline()[:-1]
-        print self.input_stream.readline()[:-1], '</pre>'
+        errDetail = self.input_stream.readline()[:-1]
+        errDetail += '\n' + self.input_stream.readline()[:-1]
+        self.emit('error', m.group(3), file=m.group(1), line=m.group(2), detail=errDetail)
         self.numErrs += 1
 
+def budgeted(sink, prefs=None):
+	"""sink behind an OutputBudget with the limits from the preferences"""
+	if prefs is None:
+		prefs = tmprefs.Preferences()
+	return OutputBudget(sink, int(prefs['latexMaxErrors']), int(prefs['latexMaxWarnings']))
+
+engineNotRun = 127      # exit status of --exec when the command could not be started, as in the shell
+
+def run_and_parse(command, fileName, sink=None, abortOnFatal=True):
+	"""Run a TeX engine and parse its terminal output while it is running, so errors
+	   show up before the compile has finished.  The engine must not run in batchmode,
+	   which writes nothing to the terminal.  If abortOnFatal is set the engine is
+	   stopped as soon as a fatal error has been seen.  Returns the engine's exit
+	   status (1 if it was stopped) and the parser.  If the engine cannot be run at
+	   all the status is engineNotRun and the parser None."""
+	from subprocess import Popen, PIPE, STDOUT
+	devnull = open(os.devnull)
+	try:
+		runObj = Popen(command, stdout=PIPE, stderr=STDOUT, stdin=devnull, bufsize=1, close_fds=True)
+	except OSError, e:
+		devnull.close()
+		sys.stderr.write("texparser.py: cannot run %s: %s\n" % (command[0], e.strerror))
+		return engineNotRun, None
+	lp = WatchDocumentParser(runObj.stdout, False, fileName, sink)
+	lp.abortOnFatal = abortOnFatal
+	lp.parseStream()
+	if lp.isFatal and abortOnFatal and runObj.poll() is None:
+		os.kill(runObj.pid, 15)
+	runObj.stdout.read()     # drain what is left, so the engine never blocks on a full pipe
+	stat = runObj.wait()
+	devnull.close()
+	if stat < 0:
+		stat = 1
+	return stat, lp
+
 if __name__ == '__main__':
     # test
     #stream = open('../tex/test.log')
-    stream = open(sys.argv[1])
-    lp = WatchDocumentParser(stream,False,sys.argv[2])
+    from optparse import OptionParser
+    from texevents import makeRenderer, renderers
+    optParser = OptionParser(usage="%prog [options] logfile texfile\n       %prog [options] --exec texfile command [args...]")
+    optParser.add_option('-f', '--format', default='html', choices=sorted(renderers.keys()),
+                         help="output format: html (default), json or text")
+    optParser.add_option('--exec', action='store_true', dest='execute', default=False,
+                         help="run command and parse its output as it is produced; exit with its status")
+    optParser.disable_interspersed_args()
+    options, args = optParser.parse_args()
+    if options.execute:
+        if len(args) < 2:
+            optParser.error("expected a tex file and a command")
+        stat, lp = run_and_parse(args[1:], args[0], budgeted(makeRenderer(options.format)))
+        sys.exit(stat)
+    if len(args) != 2:
+        optParser.error("expected a log file and a tex file")
+    stream = open(args[0])
+    lp = WatchDocumentParser(stream,False,args[1],budgeted(makeRenderer(options.format)))
     f,e,w = lp.parseStream()
     #exit(5)
     
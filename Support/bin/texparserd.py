@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Long lived log parser for Watch Document.
+#
+# latex_watch.pl used to start "python texparser.py <log> <file>" after every compile.  This
+# server keeps an interpreter with the parser classes and their compiled patterns loaded and
+# answers requests on a Unix socket instead.
+#
+# Protocol: the client sends one tab separated request line and reads the reply until the
+# server closes the connection.
+#       parse <TAB> directory <TAB> logfile <TAB> texfile [<TAB> format]
+#           parse logfile with WatchDocumentParser as if run in directory, reply with the
+#           rendered output (html unless format says otherwise)
+#       stream <TAB> directory <TAB> texfile [<TAB> format]
+#           the client sends the terminal output of a running TeX engine after the request
+#           line and shuts down its side of the connection when the engine is done; it is
+#           parsed as it arrives and the rendered output is sent back as it is produced.
+#           The server closes the connection at the end of the engine's output, or at
+#           the first fatal error, which tells the client to stop the engine.
+#       ping
+#           reply "pong"
+#
+# The server exits after idleTimeout seconds without a request.  Clients that cannot connect
+# fall back to running texparser.py directly.
+
+import sys
+import os
+import errno
+import socket
+from texparser import WatchDocumentParser, budgeted
+from texevents import makeRenderer
+
+idleTimeout = 30 * 60
+
+def socketPath():
+	"""Per user socket in the temporary directory"""
+	tmpdir = os.getenv('TMPDIR') or '/tmp'
+	return os.path.join(tmpdir, 'texparserd-%d.sock' % os.getuid())
+
+def connect(path=None):
+	"""Return a socket connected to a running server, or None"""
+	s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		s.connect(path or socketPath())
+	except socket.error:
+		s.close()
+		return None
+	return s
+
+def listen(path):
+	"""Bind the server socket, replacing a stale socket file.  Returns None if
+	   another server is already answering on path."""
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		server.bind(path)
+	except socket.error, e:
+		if e.args[0] != errno.EADDRINUSE:
+			raise
+		other = connect(path)
+		if other:
+			other.close()
+			server.close()
+			return None
+		os.remove(path)
+		server.bind(path)
+	os.chmod(path, 0600)
+	server.listen(5)
+	return server
+
+def handleRequest(conn):
+	"""Read one request from conn and write the reply to it"""
+	reader = conn.makefile('rb')
+	request = reader.readline()
+	if not request:         # a client just checking that we are up
+		return
+	request = request.rstrip('\n').split('\t')
+	out = conn.makefile('wb')
+	try:
+		if request[0] == 'ping':
+			out.write('pong\n')
+		elif request[0] == 'parse' and len(request) >= 4:
+			directory, logFile, texFile = request[1:4]
+			format = 'html'
+			if len(request) > 4:
+				format = request[4]
+			os.chdir(directory)
+			stream = open(logFile)
+			lp = WatchDocumentParser(stream, False, texFile, budgeted(makeRenderer(format, out)))
+			lp.parseStream()
+			stream.close()
+		elif request[0] == 'stream' and len(request) >= 3:
+			directory, texFile = request[1:3]
+			format = 'html'
+			if len(request) > 3:
+				format = request[3]
+			os.chdir(directory)
+			lp = WatchDocumentParser(reader, False, texFile, budgeted(makeRenderer(format, out)))
+			lp.abortOnFatal = True
+			lp.parseStream()
+			if not lp.isFatal:
+				while reader.read(65536):       # the engine may write after "Output written"
+					pass
+		else:
+			out.write('<p class="error">texparserd: bad request %r</p>\n' % '\t'.join(request))
+	except Exception, e:
+		out.write('<p class="error">texparserd: %s</p>\n' % e)
+	out.close()
+	reader.close()       # the parser may hold on to it, and with it to the connection
+
+def serve(path=None, timeout=idleTimeout):
+	"""Answer requests until nothing has arrived for timeout seconds"""
+	path = path or socketPath()
+	server = listen(path)
+	if server is None:
+		return
+	# Warm up: compile the WatchDocumentParser patterns and their combined form once.
+	WatchDocumentParser(None, False, 'warmup.tex').getDispatcher()
+	server.settimeout(timeout)
+	try:
+		while True:
+			try:
+				conn, addr = server.accept()
+			except socket.timeout:
+				break
+			conn.settimeout(None)
+			try:
+				try:
+					handleRequest(conn)
+				except socket.error:
+					pass        # the client went away
+			finally:
+				conn.close()
+	finally:
+		server.close()
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+def daemonize():
+	"""Detach from the caller and serve in the background.  The parent returns
+	   once the socket is accepting connections (or after a second)."""
+	import time
+	pid = os.fork()
+	if pid:
+		os.waitpid(pid, 0)
+		for i in range(20):
+			s = connect()
+			if s:
+				s.close()
+				break
+			time.sleep(0.05)
+		return
+	os.setsid()
+	if os.fork():
+		os._exit(0)
+	devnull = os.open(os.devnull, os.O_RDWR)
+	for fd in (0, 1, 2):
+		os.dup2(devnull, fd)
+	try:
+		serve()
+	finally:
+		os._exit(0)
+
+if __name__ == '__main__':
+	if '--daemon' in sys.argv[1:]:
+		daemonize()
+	else:
+		serve()
@@ -0,0 +1,87 @@
+import os
+import time
+import threading
+
+# Where the time of a build goes.
+#
+# A PhaseTracer records the wall clock and CPU time of named phases.  CPU time is split into
+# the time of this process and that of its finished children (os.times), so a phase that runs
+# TeX shows the engine's time as child time.  Phases may nest; jobs that run in parallel
+# threads are recorded too, but their child times can include children of the other jobs that
+# finished at the same time.
+
+class PhaseTracer(object):
+    """Record wall and CPU time of the phases of a build"""
+    fields = ('wall', 'user', 'system', 'childUser', 'childSystem')
+
+    def __init__(self):
+        super(PhaseTracer, self).__init__()
+        self.phases = []
+        self.local = threading.local()
+        self.started = self.now()
+
+    def now(self):
+        t = os.times()
+        return (time.time(), t[0], t[1], t[2], t[3])
+
+    def begin(self, name):
+        """Start the phase name, returns the record to pass to end"""
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        record = {'name' : name, 'depth' : depth, 'start' : self.now()}
+        self.phases.append(record)
+        return record
+
+    def end(self, record):
+        stop = self.now()
+        start = record.pop('start')
+        for i in range(len(self.fields)):
+            record[self.fields[i]] = stop[i] - start[i]
+        record['offset'] = start[0] - self.started[0]
+        self.local.depth -= 1
+
+    def traced(self, name=None):
+        """Decorator recording every call of a function as a phase"""
+        def decorate(fun):
+            label = name or fun.__name__
+            def call(*args, **kwargs):
+                record = self.begin(label)
+                try:
+                    return fun(*args, **kwargs)
+                finally:
+                    self.end(record)
+            call.__name__ = fun.__name__
+            call.__doc__ = fun.__doc__
+            return call
+        return decorate
+
+    def total(self):
+        """Wall and CPU time since the tracer was created"""
+        stop = self.now()
+        return dict([(self.fields[i], stop[i] - self.started[i]) for i in range(len(self.fields))])
+
+    def finished(self):
+        return [p for p in self.phases if 'wall' in p]
+
+    def html(self):
+        """The phases as a table, hidden until the timing checkbox is ticked"""
+        rows = ['<div class="timing" style="display:none;"><table>',
+                '<tr><th>Phase</th><th>Start</th><th>Wall</th><th>CPU</th><th>Children CPU</th></tr>']
+        total = self.total()
+        total.update({'name' : 'Total', 'depth' : 0, 'offset' : 0.0})
+        for p in self.finished() + [total]:
+            rows.append('<tr><td>%s%s</td><td>%.3f s</td><td>%.3f s</td><td>%.3f s</td><td>%.3f s</td></tr>' % (
+                '&nbsp;&nbsp;&nbsp;' * p['depth'], p['name'], p['offset'], p['wall'],
+                p['user'] + p['system'], p['childUser'] + p['childSystem']))
+        rows.append('</table></div>')
+        return '\n'.join(rows)
+
+    def save(self, path):
+        """Write the phases and the totals as JSON to path.  Failing to write is not an error."""
+        import json
+        try:
+            f = open(path, 'w')
+            json.dump({'phases' : self.finished(), 'total' : self.total()}, f, indent=1, sort_keys=True)
+            f.close()
+        except IOError:
+            pass
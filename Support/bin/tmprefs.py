@@ -1,6 +1,8 @@
 import os
 import newplistlib as plistlib
 import string
+import tempfile
+from cachestore import CacheFile, fileSignature
 
 try:
     from Foundation import *
@@ -27,6 +29,20 @@ except:
             stat = self.stdout.close()
             return stat
 
+def plainValue(value):
+    """Convert a preference value to a plain python value that can be cached, or None"""
+    if isinstance(value, bool):
+        return bool(value)
+    if isinstance(value, (int, long)):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, unicode):
+        return unicode(value)
+    return None
+
 class Preferences(object):
     """docstring for Preferences"""
     def __init__(self):
@@ -37,17 +53,42 @@ class Preferences(object):
             'latexEngineOptions' : "",
             'latexVerbose' : 0,
             'latexUselatexmk' : 0,
+            'latexUselatexmkPl' : 0,
             'latexViewer' : "TextMate",
             'latexKeepLogWin' : 1,
             'latexDebug' : 0,
+            'latexMaxPasses' : 5,
+            'latexFormatCache' : 0,
+            'latexMaxErrors' : 50,
+            'latexMaxWarnings' : 100,
         }
         self.prefs = self.defaults.copy()
-        self.prefs.update(self.readTMPrefs())
+        self.prefs.update(self.readCachedPrefs())
         
     def __getitem__(self,key):
         """docstring for __getitem__"""
         return self.prefs.get(key,None)
 
+    def readCachedPrefs(self):
+        """Return the latex preferences, from a snapshot in the cache directory while the
+        preferences file keeps the same mtime and size, otherwise by reading the file"""
+        prefsFile = os.environ["HOME"]+"/Library/Preferences/com.macromates.textmate.plist"
+        signature = fileSignature(prefsFile)
+        cache = CacheFile('preferences')
+        snapshot = cache.load()
+        if signature and snapshot.get('signature') == signature:
+            return snapshot['prefs']
+        prefs = {}
+        plDict = self.readTMPrefs() or {}
+        for key in plDict.keys():
+            if key.startswith('latex'):
+                value = plainValue(plDict[key])
+                if value is not None:
+                    prefs[str(key)] = value
+        if signature:
+            cache.save({'signature' : signature, 'prefs' : prefs})
+        return prefs
+
     def readTMPrefs(self):
         """readTMPrefs reads the textmate preferences file and constructs a python dictionary.
         The keys that are important for latex are as follows:
@@ -57,28 +98,43 @@ class Preferences(object):
         latexUselatexmk = 0
         latexViewer = Skim
         """
-        # ugly as this is it is the only way I have found so far to convert a binary plist file into something
-        # decent in Python without requiring the PyObjC module.  I would prefer to use popen but
+        # newplistlib reads binary plists itself and only decodes the keys we look at.  If that
+        # fails fall back to having plutil convert the file to XML.  I would prefer to use popen but
         # plutil apparently tries to do something to /dev/stdout which causes an error message to be appended
         # to the output.
         #
         plDict = {}
+        prefsFile = os.environ["HOME"]+"/Library/Preferences/com.macromates.textmate.plist"
         if haspyobjc:
-            plDict = NSDictionary.dictionaryWithContentsOfFile_(os.environ["HOME"]+"/Library/Preferences/com.macromates.textmate.plist")
-        else:   # TODO remove all this once everyone is on leopard
-            os.system("plutil -convert xml1 \"$HOME/Library/Preferences/com.macromates.textmate.plist\" -o /tmp/tmltxprefs1.plist")
-            null_tt = "".join([chr(i) for i in range(256)])
-            non_printables = null_tt.translate(null_tt, string.printable)
-            plist_str = open('/tmp/tmltxprefs1.plist').read()
-            plist_str = plist_str.translate(null_tt,non_printables)
-            try:
-                plDict = plistlib.readPlistFromString(plist_str)
-            except:
-                print '<p class="error">There was a problem reading the preferences file, continuing with defaults</p>'
+            plDict = NSDictionary.dictionaryWithContentsOfFile_(prefsFile)
+        else:
             try:
-                os.remove("/tmp/tmltxprefs1.plist")
+                if open(prefsFile, 'rb').read(len(plistlib.BINARY_HEADER)) == plistlib.BINARY_HEADER:
+                    plDict = plistlib.readBinaryPlist(prefsFile)
+                else:
+                    plDict = plistlib.readPlist(prefsFile)
             except:
-                print '<p class="error">Problem removing temporary prefs file</p>'
+                plDict = self.readTMPrefsWithPlutil()
+        return plDict
+
+    def readTMPrefsWithPlutil(self):
+        """Convert the preferences to XML with plutil and parse that"""
+        plDict = {}
+        fd, tmpPlist = tempfile.mkstemp(suffix='.plist', prefix='tmltxprefs')
+        os.close(fd)
+        os.system("plutil -convert xml1 \"$HOME/Library/Preferences/com.macromates.textmate.plist\" -o \"%s\"" % tmpPlist)
+        null_tt = "".join([chr(i) for i in range(256)])
+        non_printables = null_tt.translate(null_tt, string.printable)
+        plist_str = open(tmpPlist).read()
+        plist_str = plist_str.translate(null_tt,non_printables)
+        try:
+            plDict = plistlib.readPlistFromString(plist_str)
+        except:
+            print '<p class="error">There was a problem reading the preferences file, continuing with defaults</p>'
+        try:
+            os.remove(tmpPlist)
+        except:
+            print '<p class="error">Problem removing temporary prefs file</p>'
         return plDict
         
     def toDefString(self):
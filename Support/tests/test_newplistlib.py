@@ -0,0 +1,62 @@
+# encoding: utf-8
+
+# Run with: python -m unittest discover -s Support/tests
+
+import os
+import sys
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin'))
+from newplistlib import BinaryPlistParser, Data, InvalidBinaryPlist, readBinaryPlist, readPlist
+
+# Written by Python 3's plistlib (plistlib.dump(..., fmt=plistlib.FMT_BINARY)), so the
+# parser is checked against an independent writer.  Its 336 objects need two byte
+# object references.
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'types.bplist')
+
+
+class BinaryPlistTest(unittest.TestCase):
+    def check(self, root):
+        self.assertEqual(root['byte'], 200)
+        self.assertEqual(root['short'], 40000)
+        self.assertEqual(root['int'], 3000000000)
+        self.assertEqual(root['long'], 2 ** 40)
+        self.assertEqual(root['negative'], -5)
+        self.assertEqual(root['real'], 2.5)
+        self.assertTrue(root['yes'] is True)
+        self.assertTrue(root['no'] is False)
+        self.assertEqual(root['ascii'], 'pdflatex')
+        self.assertEqual(root['unicode'], u'caf\xe9 – na\xefve')
+        self.assertTrue(isinstance(root['data'], Data))
+        self.assertEqual(root['data'].data, '\x00\x01\xfe\xff')
+        self.assertEqual(root['date'], datetime.datetime(2007, 7, 17, 12, 30, 0))
+        nested = root['nested']
+        self.assertEqual(nested['list'][:2], [1, 'two'])
+        self.assertEqual(nested['list'][2][0], 3)
+        self.assertEqual(nested['list'][2][1]['four'], 4)
+        self.assertEqual(len(nested['empty']), 0)
+        self.assertEqual(root['many'], range(300))
+
+    def testReadBinaryPlist(self):
+        self.check(readBinaryPlist(fixture))
+
+    def testReadBinaryPlistNotLazy(self):
+        self.check(readBinaryPlist(fixture, lazy=False))
+
+    def testReadPlist(self):
+        self.check(readPlist(fixture))
+
+    def testLazyDictKeys(self):
+        root = readBinaryPlist(fixture)
+        self.assertEqual(sorted(root.keys()), ['ascii', 'byte', 'data', 'date', 'int', 'long', 'many',
+                                               'negative', 'nested', 'no', 'real', 'short', 'unicode', 'yes'])
+        self.assertTrue('many' in root)
+        self.assertEqual(root.get('missing', 1), 1)
+
+    def testNotABinaryPlist(self):
+        self.assertRaises(InvalidBinaryPlist, BinaryPlistParser, '<?xml version="1.0"?>' + ' ' * 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
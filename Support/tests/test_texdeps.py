@@ -0,0 +1,71 @@
+# encoding: utf-8
+
+# Run with: python -m unittest discover -s Support/tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin'))
+from texdeps import KpseResolver
+
+# Prints ./name (or ./name.tex) for every name that exists in the current directory
+fakeKpsewhich = """#!/bin/sh
+for name in "$@"; do
+    case "$name" in -*) continue ;; esac
+    if [ -f "$name" ]; then echo "./$name"; elif [ -f "$name.tex" ]; then echo "./$name.tex"; fi
+done
+"""
+
+
+class KpseResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.oldDir = os.getcwd()
+        self.oldEnv = dict([(key, os.environ.get(key)) for key in ('PATH', 'TM_LATEX_CACHE_DIR')])
+        self.tmp = tempfile.mkdtemp(prefix='texdeps-test')
+        bin = os.path.join(self.tmp, 'bin')
+        os.mkdir(bin)
+        script = os.path.join(bin, 'kpsewhich')
+        f = open(script, 'w')
+        f.write(fakeKpsewhich)
+        f.close()
+        os.chmod(script, 0755)
+        os.environ['PATH'] = bin + os.pathsep + os.environ['PATH']
+        os.environ['TM_LATEX_CACHE_DIR'] = os.path.join(self.tmp, 'cache')
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.oldDir)
+        for key, value in self.oldEnv.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(self.tmp)
+
+    def touch(self, name):
+        open(name, 'w').close()
+
+    def testMissingFileIsNotPairedWithLongerName(self):
+        self.touch('mydefs.tex')
+        paths = KpseResolver().resolve(['defs.tex', 'mydefs.tex'])
+        self.assertEqual(paths, {'defs.tex' : '', 'mydefs.tex' : './mydefs.tex'})
+        # the wrong answer must not have been cached either
+        self.assertEqual(KpseResolver().resolve(['defs.tex']), {'defs.tex' : ''})
+
+    def testNameWithoutSuffix(self):
+        self.touch('defs.tex')
+        self.touch('macros.sty')
+        paths = KpseResolver().resolve(['defs', 'macros.sty'])
+        self.assertEqual(paths, {'defs' : './defs.tex', 'macros.sty' : './macros.sty'})
+
+    def testAmbiguousNamesAreLookedUpAlone(self):
+        self.touch('defs.tex')
+        paths = KpseResolver().resolve(['defs', 'defs.tex', 'other.tex'])
+        self.assertEqual(paths, {'defs' : './defs.tex', 'defs.tex' : './defs.tex', 'other.tex' : ''})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# encoding: utf-8
+
+# Run with: python -m unittest discover -s Support/tests
+
+import os
+import sys
+import json
+import time
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin'))
+os.environ.setdefault('TM_FILEPATH', 'paper.tex')      # LaTexParser.badRun names the log after it
+from texevents import BufferedWriter, Event, EventBuffer, JsonLinesRenderer, WarningAggregator
+from texparser import LaTexParser
+
+
+class JsonLinesRendererTest(unittest.TestCase):
+    def parse(self, log):
+        out = StringIO()
+        parser = LaTexParser(StringIO(log), False, 'paper.tex', JsonLinesRenderer(out))
+        parser.parseStream()
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def testLatin1Message(self):
+        events = self.parse("LaTeX Warning: Reference `caf\xe9' on page 1 undefined on input line 3.\n")
+        messages = [e['message'] for e in events if e['kind'] == 'warning']
+        self.assertEqual(messages, [u"LaTeX Warning: Reference `caf\xe9' on page 1 undefined on input line 3."])
+
+    def testUtf8Message(self):
+        events = self.parse("Overfull \\hbox (1.0pt too wide) in paragraph at lines 5--6 na\xc3\xafve\n")
+        messages = [e['message'] for e in events if e['kind'] == 'fmtWarning']
+        self.assertEqual(messages, [u"Overfull \\hbox (1.0pt too wide) in paragraph at lines 5--6 na\xefve"])
+
+
+class BufferedWriterTest(unittest.TestCase):
+    def testWaitingOutputIsWrittenByTheTimer(self):
+        out = StringIO()
+        writer = BufferedWriter(out, interval=0.05)
+        writer.write('<p>one</p>')
+        self.assertEqual(out.getvalue(), '')
+        time.sleep(0.3)
+        self.assertEqual(out.getvalue(), '<p>one</p>')
+
+    def testLargeOutputIsWrittenAtOnce(self):
+        out = StringIO()
+        writer = BufferedWriter(out, interval=60, size=10)
+        writer.write('0123456789')
+        self.assertEqual(out.getvalue(), '0123456789')
+
+
+class WarningAggregatorTest(unittest.TestCase):
+    def warning(self, line):
+        return Event('fmtWarning', 'Overfull \\hbox (1.%dpt too wide) in paragraph at lines %d--%d' % (line, line, line + 1),
+                     'paper.tex', line)
+
+    def testFirstWarningIsSentAtOnce(self):
+        buf = EventBuffer()
+        agg = WarningAggregator(buf)
+        agg.emit(self.warning(3))
+        self.assertEqual([e.line for e in buf.events], [3])
+        agg.emit(Event('error', 'Undefined control sequence', 'paper.tex', 4))
+        self.assertEqual([e.kind for e in buf.events], ['fmtWarning', 'error'])
+
+    def testRepeatsAreSentAsOneGroup(self):
+        buf = EventBuffer()
+        agg = WarningAggregator(buf)
+        for line in (3, 7, 9):
+            agg.emit(self.warning(line))
+        self.assertEqual(len(buf.events), 1)
+        agg.emit(Event('end', ''))
+        self.assertEqual([e.kind for e in buf.events], ['fmtWarning', 'warningGroup', 'end'])
+        group = buf.events[1].detail
+        self.assertEqual((group['kind'], group['count'], group['lines']), ('fmtWarning', 2, [7, 9]))
+
+    def testSingleWarningHasNoGroup(self):
+        buf = EventBuffer()
+        agg = WarningAggregator(buf)
+        agg.emit(self.warning(3))
+        agg.flush()
+        self.assertEqual([e.kind for e in buf.events], ['fmtWarning'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# encoding: utf-8
+
+# Run with: python -m unittest discover -s Support/tests
+
+import os
+import sys
+import unittest
+from StringIO import StringIO
+
+support = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(support, 'bin'))
+sys.path.insert(0, os.path.join(support, 'benchmarks'))
+os.environ.setdefault('TM_FILEPATH', 'paper.tex')      # LaTexParser.badRun names the log after it
+import genlogs
+from texevents import EventBuffer
+from texparser import BibTexParser, ChkTeXParser, LaTexParser, ParseLatexMk, WatchDocumentParser
+
+
+class RerunTest(unittest.TestCase):
+    def parse(self, log):
+        parser = LaTexParser(StringIO(log), False, 'paper.tex', EventBuffer())
+        parser.parseStream()
+        return parser
+
+    def testBoxContentDoesNotAskForRerun(self):
+        parser = self.parse('Overfull \\hbox (3.0pt too wide) in paragraph at lines 3--4\n'
+                            '[]\\OT1/cmr/m/n/10 the value may have changed since the last\n'
+                            '[]\\OT1/cmr/m/n/10 Rerun to get the numbers\n'
+                            '\n')
+        self.assertFalse(parser.rerunRequested)
+        self.assertEqual(parser.numWarns, 0)
+
+    def testLatexWarning(self):
+        parser = self.parse('LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.\n')
+        self.assertTrue(parser.rerunRequested)
+        self.assertEqual(parser.numWarns, 1)
+
+    def testPackageWarningIsNotCounted(self):
+        parser = self.parse('Package natbib Warning: Citation(s) may have changed.\n'
+                            '(natbib)                Rerun to get citations correct.\n')
+        self.assertTrue(parser.rerunRequested)
+        self.assertEqual(parser.numWarns, 0)
+
+    def testContinuationLine(self):
+        parser = self.parse("Package rerunfilecheck Warning: File `paper.out' has changed.\n"
+                            '(rerunfilecheck)                Rerun to get outlines right\n')
+        self.assertTrue(parser.rerunRequested)
+
+
+class DispatcherTest(unittest.TestCase):
+    """The combined pattern must pick the same handler, with the same groups, as
+       trying the patterns one at a time"""
+    parsers = [(LaTexParser, 'latex'), (WatchDocumentParser, 'latex'), (ParseLatexMk, 'latexmk'),
+               (BibTexParser, 'bibtex'), (ChkTeXParser, 'chktex')]
+
+    def makeParser(self, parserClass, log):
+        if parserClass is BibTexParser:
+            return parserClass(StringIO(log), False, EventBuffer())
+        return parserClass(StringIO(log), False, 'paper.tex', EventBuffer())
+
+    def sequential(self, patterns, line):
+        for pat,fun in patterns:
+            myMatch = pat.match(line)
+            if myMatch:
+                return myMatch, fun
+        return None
+
+    def testSameHandlerAndGroups(self):
+        for parserClass, kind in self.parsers:
+            for seed in (0, 1):
+                parser = self.makeParser(parserClass, genlogs.generate(kind, 3000, seed))
+                dispatcher = parser.getDispatcher()
+                self.assertTrue(dispatcher.combined is not None, parserClass.__name__)
+                hits = 0
+                line = parser.getRewrappedLine()
+                while line:
+                    line = line.rstrip("\n")
+                    expected = self.sequential(parser.patterns, line)
+                    found = dispatcher.match(line)
+                    if expected is None:
+                        self.assertEqual(found, None, '%s: %r' % (parserClass.__name__, line))
+                    else:
+                        hits += 1
+                        self.assertNotEqual(found, None, '%s: %r' % (parserClass.__name__, line))
+                        self.assertEqual(found[1], expected[1], '%s: %r' % (parserClass.__name__, line))
+                        self.assertEqual(found[0].re, expected[0].re)
+                        self.assertEqual(found[0].group(0), expected[0].group(0))
+                        self.assertEqual(found[0].groups(), expected[0].groups())
+                    line = parser.getRewrappedLine()
+                self.assertTrue(hits, parserClass.__name__)
+
+
+if __name__ == '__main__':
+    unittest.main()